@@ -0,0 +1,209 @@
+from itertools import izip
+from multiprocessing.pool import ThreadPool
+
+import numpy
+
+GRAVITY = -9.81
+
+class SphereBodyBatch(object):
+
+    #Steps many independent spheres against static planes and a heightfield in one
+    #vectorized pass instead of one ActorNode and collider per body
+
+    MIN_CHUNK = 4096
+
+    #Contacts slower than this along the normal are resting, not bouncing; it has to sit
+    #above the speed gravity adds in one frame, or settled bodies would bounce every step
+
+    BOUNCE_SPEED = 1.0
+
+    def __init__(self, capacity, gravity=GRAVITY, restitution=.8, workers=1):
+
+        self.capacity = capacity
+        self.count = 0
+
+        self.positions = numpy.zeros((capacity, 3))
+        self.velocities = numpy.zeros((capacity, 3))
+        self.radii = numpy.zeros(capacity)
+        self.bounced = numpy.zeros(capacity, bool)
+
+        self.nodes = []
+
+        self.gravity = gravity
+        self.restitution = restitution
+
+        self.planes = []
+
+        self.heights = None
+        self.heightOrigin = (0, 0)
+        self.heightSpacing = 1.0
+
+        #Numpy releases the GIL inside its kernels, so large batches can be split
+        #across a thread pool
+
+        self.pool = ThreadPool(workers) if workers > 1 else None
+        self.workers = workers
+
+    def addBody(self, nodePath, radius, velocity=(0, 0, 0)):
+
+        if self.count == self.capacity:
+
+            self.grow(self.capacity * 2)
+
+        index = self.count
+
+        self.positions[index] = nodePath.getPos()
+        self.velocities[index] = velocity
+        self.radii[index] = radius
+
+        self.nodes.append(nodePath)
+
+        self.count += 1
+
+        return index
+
+    def grow(self, capacity):
+
+        for name in ("positions", "velocities", "radii", "bounced"):
+
+            old = getattr(self, name)
+
+            new = numpy.zeros((capacity,) + old.shape[1:], old.dtype)
+            new[:self.count] = old[:self.count]
+
+            setattr(self, name, new)
+
+        self.capacity = capacity
+
+    def addPlane(self, normal, point):
+
+        normal = numpy.asarray(normal, float)
+        normal /= numpy.sqrt(normal.dot(normal))
+
+        self.planes.append((normal, normal.dot(numpy.asarray(point, float))))
+
+    def setHeightfield(self, heights, origin=(0, 0), spacing=1.0):
+
+        #heights[i][j] is the world Z at (origin[0] + i*spacing, origin[1] + j*spacing)
+
+        self.heights = numpy.asarray(heights, float)
+        self.heightOrigin = origin
+        self.heightSpacing = float(spacing)
+
+    def setHeightfieldFromTerrain(self, terrain):
+
+        root = terrain.getRoot()
+
+        size = terrain.heightfield().getXSize()
+
+        heights = numpy.array([[terrain.getElevation(i, j) for j in range(size)] for i in range(size)])
+
+        self.setHeightfield(heights * root.getSz(), (root.getX(), root.getY()), root.getSx())
+
+    def stepRange(self, bounds):
+
+        start, end = bounds
+
+        pos = self.positions[start:end]
+        vel = self.velocities[start:end]
+        radii = self.radii[start:end]
+        bounced = self.bounced[start:end]
+
+        dt = self.dt
+
+        vel[:, 2] += self.gravity * dt
+        pos += vel * dt
+
+        bounced[:] = False
+
+        for normal, offset in self.planes:
+
+            depth = radii - (pos.dot(normal) - offset)
+
+            hit = depth > 0
+
+            if not hit.any(): continue
+
+            pos[hit] += numpy.outer(depth[hit], normal)
+
+            approach = numpy.minimum(vel[hit].dot(normal), 0)
+
+            vel[hit] -= numpy.outer((1 + self.restitution) * approach, normal)
+
+            bounced[hit] |= approach < -SphereBodyBatch.BOUNCE_SPEED
+
+        if self.heights is not None:
+
+            #Bilinear height lookup, contact normal treated as straight up
+
+            maxIndex = numpy.array(self.heights.shape) - 2
+
+            gx = numpy.clip((pos[:, 0] - self.heightOrigin[0]) / self.heightSpacing, 0, maxIndex[0])
+            gy = numpy.clip((pos[:, 1] - self.heightOrigin[1]) / self.heightSpacing, 0, maxIndex[1])
+
+            ix = gx.astype(int)
+            iy = gy.astype(int)
+
+            fx = gx - ix
+            fy = gy - iy
+
+            heights = self.heights
+
+            ground = (heights[ix, iy] * (1 - fx) * (1 - fy) + heights[ix + 1, iy] * fx * (1 - fy) +
+                      heights[ix, iy + 1] * (1 - fx) * fy + heights[ix + 1, iy + 1] * fx * fy)
+
+            depth = ground + radii - pos[:, 2]
+
+            hit = depth > 0
+
+            if hit.any():
+
+                pos[hit, 2] += depth[hit]
+
+                bounced[hit] |= vel[hit, 2] < -SphereBodyBatch.BOUNCE_SPEED
+
+                vel[hit, 2] = numpy.where(vel[hit, 2] < 0, -self.restitution * vel[hit, 2], vel[hit, 2])
+
+    def step(self, dt):
+
+        self.dt = dt
+
+        if self.pool is None or self.count < 2 * SphereBodyBatch.MIN_CHUNK:
+
+            self.stepRange((0, self.count))
+
+        else:
+
+            chunk = max(SphereBodyBatch.MIN_CHUNK, self.count // self.workers + 1)
+
+            self.pool.map(self.stepRange, [(start, min(start + chunk, self.count))
+                                           for start in range(0, self.count, chunk)])
+
+    def writeBack(self):
+
+        #tolist() converts in one call, so the loop only touches plain floats
+
+        for nodePath, (x, y, z) in izip(self.nodes, self.positions[:self.count].tolist()):
+
+            nodePath.setPos(x, y, z)
+
+    def update(self, task):
+
+        self.step(globalClock.getDt())
+
+        self.writeBack()
+
+        return task.cont
+
+    def numBounced(self):
+
+        return int(self.bounced[:self.count].sum())
+
+    def destroy(self):
+
+        if self.pool is not None:
+
+            self.pool.close()
+
+        self.nodes = []
+        self.count = 0
@@ -0,0 +1,168 @@
+from itertools import izip
+
+import numpy
+
+from panda3d.core import Geom, GeomNode, GeomTriangles, GeomVertexData
+from panda3d.core import GeomVertexFormat, GeomVertexArrayFormat, InternalName
+from panda3d.core import TransparencyAttrib, OmniBoundingVolume
+
+class BlobShadowSystem(object):
+
+    #Owns every blob shadow and refreshes them all from one array of body positions
+    #in a single task, either as separate cards or as one batched Geom
+
+    CORNERS = numpy.array([(-1, -1), (1, -1), (1, 1), (-1, 1)], numpy.float32)
+    TEXCOORDS = numpy.array([(0, 0), (1, 0), (1, 1), (0, 1)], numpy.float32)
+
+    def __init__(self, parent, capacity, shadowCard=None, batched=False, size=1.0,
+                 groundZ=.1, fadeHeight=30.0, minScale=.25, maxScale=.9):
+
+        self.root = parent.attachNewNode("blob-shadows")
+        self.root.setTransparency(TransparencyAttrib.MAlpha)
+
+        self.capacity = capacity
+        self.batched = batched
+
+        self.size = size
+        self.groundZ = groundZ
+        self.fadeHeight = float(fadeHeight)
+        self.minScale = minScale
+        self.maxScale = maxScale
+
+        self.cards = []
+        self.visibleCards = 0
+
+        self.source = None
+        self.task = None
+
+        if batched:
+
+            self.buildBatchedGeom()
+
+        else:
+
+            for i in range(capacity):
+
+                card = self.root.attachNewNode("shadownode")
+                card.hide()
+                shadowCard.instanceTo(card)
+
+                self.cards.append(card)
+
+    def buildBatchedGeom(self):
+
+        #Float colours keep the vertex rows a fixed stride, so the whole array can
+        #be replaced with one setData call per frame
+
+        arrayFormat = GeomVertexArrayFormat()
+        arrayFormat.addColumn(InternalName.getVertex(), 3, Geom.NTFloat32, Geom.CPoint)
+        arrayFormat.addColumn(InternalName.getColor(), 4, Geom.NTFloat32, Geom.CColor)
+        arrayFormat.addColumn(InternalName.getTexcoord(), 2, Geom.NTFloat32, Geom.CTexcoord)
+
+        vertexFormat = GeomVertexFormat.registerFormat(GeomVertexFormat(arrayFormat))
+
+        self.vertexData = GeomVertexData("blob-shadows", vertexFormat, Geom.UHDynamic)
+        self.vertexData.uncleanSetNumRows(4 * self.capacity)
+
+        self.rows = numpy.zeros((self.capacity, 4, 9), numpy.float32)
+        self.rows[:, :, 7:9] = BlobShadowSystem.TEXCOORDS
+
+        triangles = GeomTriangles(Geom.UHStatic)
+
+        for i in range(self.capacity):
+
+            triangles.addVertices(4*i, 4*i + 1, 4*i + 2)
+            triangles.addVertices(4*i, 4*i + 2, 4*i + 3)
+
+        geom = Geom(self.vertexData)
+        geom.addPrimitive(triangles)
+
+        geomNode = GeomNode("blob-shadow-geom")
+        geomNode.addGeom(geom)
+
+        #The vertices move every frame, so never cull the batch on stale bounds
+
+        geomNode.setBounds(OmniBoundingVolume())
+        geomNode.setFinal(True)
+
+        self.root.attachNewNode(geomNode)
+
+        self.writeRows()
+
+    def writeRows(self):
+
+        self.vertexData.modifyArray(0).modifyHandle().setData(self.rows.tostring())
+
+    def shadowScales(self, heights):
+
+        return numpy.clip(1.0 - heights / self.fadeHeight, self.minScale, self.maxScale)
+
+    def update(self, positions):
+
+        count = min(len(positions), self.capacity)
+
+        positions = positions[:count]
+
+        scales = self.shadowScales(positions[:, 2])
+
+        if self.batched:
+
+            rows = self.rows
+
+            rows[:count, :, 0:2] = (positions[:, numpy.newaxis, 0:2] +
+                                    BlobShadowSystem.CORNERS * (self.size * scales)[:, numpy.newaxis, numpy.newaxis])
+            rows[:count, :, 2] = self.groundZ
+            rows[:count, :, 6] = scales[:, numpy.newaxis]
+
+            #Unused slots collapse to zero area
+
+            rows[count:, :, 0:3] = 0
+
+            self.writeRows()
+
+        else:
+
+            for card, (x, y, z), scale in izip(self.cards, positions.tolist(), scales.tolist()):
+
+                card.setPosHprScale(x, y, self.groundZ, 0, 0, 0, scale, scale, scale)
+                card.setColor(0, 0, 0, scale)
+
+            for card in self.cards[self.visibleCards:count]:
+
+                card.show()
+
+            for card in self.cards[count:self.visibleCards]:
+
+                card.hide()
+
+            self.visibleCards = count
+
+    def refresh(self, task):
+
+        self.update(self.source())
+
+        return task.cont
+
+    def start(self, source, sort=0):
+
+        #source returns an (N, 3) array of body positions each frame
+
+        self.source = source
+
+        self.task = taskMgr.add(self.refresh, "blobShadows", sort=sort)
+
+    def stop(self):
+
+        if self.task is not None:
+
+            taskMgr.remove(self.task)
+
+            self.task = None
+
+    def destroy(self):
+
+        self.stop()
+
+        self.root.removeNode()
+
+        self.cards = []
@@ -0,0 +1,329 @@
+import sys
+import glob
+from math import sqrt
+from itertools import combinations
+from random import shuffle, seed
+
+from panda3d.core import loadPrcFileData
+
+loadPrcFileData("", "window-type none")
+loadPrcFileData("", "audio-library-name null")
+
+from panda3d.core import GeomVertexReader
+import direct.directbase.DirectStart
+
+#Offline collision volume fitting:
+#
+#   ppython fitCollisionVolumes.py [modelPath ...]
+#
+#For each model this writes <model>.bounds next to it, in model space:
+#
+#   sphere cx cy cz r                   minimal bounding sphere
+#   tree cx cy cz r                     one line per leaf of a small sphere-tree
+#   capsule ax ay az bx by bz r         tight capsule around the principal axis
+#   preferred <sphere|tree|capsule>     the tightest of the three
+#
+#main.py builds CollisionSphere/CollisionTube solids from these through ModelCache and turns
+#them with the spin shader's rotation near the avatar. Generate them alongside the asteroid
+#meshes; the meshes and their .bounds files are not checked in.
+
+MODELS = ["models/Asteroid_2", "models/Asteroid_3"]
+
+MODEL_EXTENSIONS = (".egg.pz", ".egg", ".bam")
+
+TREE_DEPTH = 2
+
+#A sphere-tree costs one narrow-phase test per leaf, so it must be this much tighter to win
+
+TREE_PENALTY = 1.25
+
+def readVertices(model):
+
+    #Distinct model-space vertex positions
+
+    points = set()
+
+    geomNodes = model.findAllMatches("**/+GeomNode")
+
+    for i in range(geomNodes.getNumPaths()):
+
+        nodePath = geomNodes.getPath(i)
+        node = nodePath.node()
+
+        mat = nodePath.getMat(model)
+
+        for j in range(node.getNumGeoms()):
+
+            vertexData = node.getGeom(j).getVertexData()
+
+            reader = GeomVertexReader(vertexData, "vertex")
+
+            while not reader.isAtEnd():
+
+                point = mat.xformPoint(reader.getData3f())
+
+                points.add((point[0], point[1], point[2]))
+
+    return list(points)
+
+######### Vector helpers #########
+
+def sub(a, b): return (a[0] - b[0], a[1] - b[1], a[2] - b[2])
+
+def add(a, b): return (a[0] + b[0], a[1] + b[1], a[2] + b[2])
+
+def scale(a, s): return (a[0] * s, a[1] * s, a[2] * s)
+
+def dot(a, b): return a[0] * b[0] + a[1] * b[1] + a[2] * b[2]
+
+def cross(a, b): return (a[1] * b[2] - a[2] * b[1], a[2] * b[0] - a[0] * b[2], a[0] * b[1] - a[1] * b[0])
+
+def length(a): return sqrt(dot(a, a))
+
+######### Minimal bounding sphere #########
+
+EPSILON = 1e-7
+
+def exactSphere(boundary):
+
+    #Smallest sphere with every boundary point on its surface, None if degenerate
+
+    if len(boundary) == 0: return ((0.0, 0.0, 0.0), -1.0)
+
+    if len(boundary) == 1: return (boundary[0], 0.0)
+
+    if len(boundary) == 2:
+
+        center = scale(add(boundary[0], boundary[1]), .5)
+
+        return (center, length(sub(boundary[0], center)))
+
+    a = boundary[0]
+
+    if len(boundary) == 3:
+
+        ab = sub(boundary[1], a)
+        ac = sub(boundary[2], a)
+
+        normal = cross(ab, ac)
+
+        denominator = 2 * dot(normal, normal)
+
+        if denominator < EPSILON: return None
+
+        offset = scale(add(scale(cross(normal, ab), dot(ac, ac)), scale(cross(ac, normal), dot(ab, ab))), 1 / denominator)
+
+        return (add(a, offset), length(offset))
+
+    ab = sub(boundary[1], a)
+    ac = sub(boundary[2], a)
+    ad = sub(boundary[3], a)
+
+    denominator = 2 * dot(ab, cross(ac, ad))
+
+    if abs(denominator) < EPSILON: return None
+
+    offset = scale(add(add(scale(cross(ac, ad), dot(ab, ab)), scale(cross(ad, ab), dot(ac, ac))),
+                       scale(cross(ab, ac), dot(ad, ad))), 1 / denominator)
+
+    return (add(a, offset), length(offset))
+
+def contains(sphere, point):
+
+    return length(sub(point, sphere[0])) <= sphere[1] * (1 + 1e-9) + EPSILON
+
+def circumsphere(boundary):
+
+    sphere = exactSphere(boundary)
+
+    if sphere is not None: return sphere
+
+    #Collinear or coplanar boundary: the smallest sphere through a subset that still holds them all
+
+    candidates = [exactSphere(list(subset)) for size in range(2, len(boundary)) for subset in combinations(boundary, size)]
+
+    valid = [candidate for candidate in candidates
+             if candidate is not None and all(contains(candidate, point) for point in boundary)]
+
+    if valid: return min(valid, key=lambda candidate: candidate[1])
+
+    center = scale(reduce(add, boundary), 1.0 / len(boundary))
+
+    return (center, max(length(sub(point, center)) for point in boundary))
+
+def boundedSphere(points, boundary):
+
+    #Welzl's algorithm unrolled into loops; recursion only goes as deep as the boundary (four)
+
+    sphere = circumsphere(boundary)
+
+    for i, point in enumerate(points):
+
+        if contains(sphere, point): continue
+
+        if len(boundary) == 3:
+
+            sphere = circumsphere(boundary + [point])
+
+        else:
+
+            sphere = boundedSphere(points[:i], boundary + [point])
+
+    return sphere
+
+def minimalSphere(points):
+
+    points = list(points)
+
+    shuffle(points)
+
+    return boundedSphere(points, [])
+
+######### Sphere-tree #########
+
+def sphereTree(points, depth):
+
+    #Median splits along the longest extent; leaves are minimal spheres
+
+    if depth == 0 or len(points) < 8: return [minimalSphere(points)]
+
+    extents = [max(p[axis] for p in points) - min(p[axis] for p in points) for axis in range(3)]
+
+    axis = extents.index(max(extents))
+
+    ordered = sorted(points, key=lambda p: p[axis])
+
+    middle = len(ordered) // 2
+
+    return sphereTree(ordered[:middle], depth - 1) + sphereTree(ordered[middle:], depth - 1)
+
+######### Capsule #########
+
+def principalAxis(points):
+
+    mean = scale(reduce(add, points), 1.0 / len(points))
+
+    covariance = [[0.0] * 3 for i in range(3)]
+
+    for point in points:
+
+        d = sub(point, mean)
+
+        for i in range(3):
+
+            for j in range(3):
+
+                covariance[i][j] += d[i] * d[j]
+
+    #Power iteration for the dominant eigenvector
+
+    axis = (1.0, 1.0, 1.0)
+
+    for iteration in range(50):
+
+        axis = tuple(dot(row, axis) for row in covariance)
+
+        size = length(axis)
+
+        if size < EPSILON: return mean, (0.0, 0.0, 1.0)
+
+        axis = scale(axis, 1 / size)
+
+    return mean, axis
+
+def capsule(points):
+
+    origin, axis = principalAxis(points)
+
+    projections = []
+
+    for point in points:
+
+        d = sub(point, origin)
+
+        t = dot(d, axis)
+
+        projections.append((t, length(sub(d, scale(axis, t)))))
+
+    radius = max(distance for t, distance in projections)
+
+    #Pull each end in as far as its hemispherical cap still covers every point
+
+    low = min(t + sqrt(max(radius * radius - distance * distance, 0)) for t, distance in projections)
+    high = max(t - sqrt(max(radius * radius - distance * distance, 0)) for t, distance in projections)
+
+    if low > high: low = high = .5 * (low + high)
+
+    return add(origin, scale(axis, low)), add(origin, scale(axis, high)), radius
+
+######### Volumes #########
+
+def sphereVolume(radius): return 4.18879 * radius ** 3
+
+def capsuleVolume(a, b, radius): return sphereVolume(radius) + 3.14159 * radius * radius * length(sub(b, a))
+
+def fitVolumes(points):
+
+    sphere = minimalSphere(points)
+    tree = sphereTree(points, TREE_DEPTH)
+    tube = capsule(points)
+
+    volumes = {"sphere": sphereVolume(sphere[1]),
+               "tree": TREE_PENALTY * sum(sphereVolume(leaf[1]) for leaf in tree),
+               "capsule": capsuleVolume(*tube)}
+
+    preferred = min(volumes, key=volumes.get)
+
+    return sphere, tree, tube, preferred
+
+def writeBounds(path, sphere, tree, tube, preferred):
+
+    output = open(path, "w")
+
+    output.write("sphere %f %f %f %f\n" % (sphere[0] + (sphere[1],)))
+
+    for center, radius in tree:
+
+        output.write("tree %f %f %f %f\n" % (center + (radius,)))
+
+    output.write("capsule %f %f %f %f %f %f %f\n" % (tube[0] + tube[1] + (tube[2],)))
+    output.write("preferred %s\n" % preferred)
+
+    output.close()
+
+def modelPaths():
+
+    paths = list(MODELS)
+
+    for extension in MODEL_EXTENSIONS:
+
+        for path in glob.glob("models/*" + extension):
+
+            path = path[:-len(extension)]
+
+            if path not in paths: paths.append(path)
+
+    return paths
+
+seed(1)
+
+for modelPath in (sys.argv[1:] or modelPaths()):
+
+    model = loader.loadModel(modelPath, okMissing=True)
+
+    if model is None:
+
+        print "%s: not found, skipped" % modelPath
+
+        continue
+
+    points = readVertices(model)
+
+    sphere, tree, tube, preferred = fitVolumes(points)
+
+    writeBounds(modelPath + ".bounds", sphere, tree, tube, preferred)
+
+    print "%s: %d vertices, sphere r=%.3f, %d tree leaves, capsule r=%.3f, preferred %s" % (modelPath, len(points), sphere[1],
+                                                                                          len(tree), tube[2], preferred)
+
+    model.removeNode()
@@ -0,0 +1,253 @@
+import sys
+
+from panda3d.core import loadPrcFileData
+
+loadPrcFileData("", "window-type offscreen")
+loadPrcFileData("", "audio-library-name null")
+
+from panda3d.core import NodePath, GeomNode, Geom, GeomTriangles, GeomVertexData
+from panda3d.core import GeomVertexFormat, GeomVertexReader, GeomVertexWriter
+from panda3d.core import Camera, OrthographicLens, Texture, FrameBufferProperties
+from panda3d.core import Filename, Vec3, Vec4
+import direct.directbase.DirectStart
+
+#Offline LOD generation for the asteroid models:
+#
+#   ppython generateAsteroidLOD.py [modelPath ...]
+#
+#For each model this writes <model>_lod1.bam, <model>_lod2.bam, ... decimated by
+#vertex clustering, and <model>_impostor.png, a transparent front view used for the
+#far-field billboard. main.py picks these files up through ModelCache when
+#GRAPHICS_SETTINGS["ast_lod"] is on.
+
+MODELS = ["models/Asteroid_2", "models/Asteroid_3"]
+
+#Clustering grid cells across the model's largest extent, one entry per LOD level
+
+LOD_RESOLUTIONS = (12, 6)
+
+IMPOSTOR_SIZE = 128
+
+def lodPath(modelPath, level):
+
+    return "%s_lod%d.bam" % (modelPath, level)
+
+def impostorPath(modelPath):
+
+    return "%s_impostor.png" % modelPath
+
+def readTriangles(model):
+
+    #Flat lists of model-space positions and texcoords plus index triples, along with
+    #the render state of the first Geom (the asteroids carry a single texture)
+
+    positions = []
+    texcoords = []
+    triangles = []
+
+    state = None
+
+    geomNodes = model.findAllMatches("**/+GeomNode")
+
+    for i in range(geomNodes.getNumPaths()):
+
+        nodePath = geomNodes.getPath(i)
+        node = nodePath.node()
+
+        mat = nodePath.getMat(model)
+
+        for j in range(node.getNumGeoms()):
+
+            if state is None: state = node.getGeomState(j)
+
+            geom = node.getGeom(j).decompose()
+            vertexData = geom.getVertexData()
+
+            vertexReader = GeomVertexReader(vertexData, "vertex")
+            hasTexcoords = vertexData.hasColumn("texcoord")
+
+            if hasTexcoords: texcoordReader = GeomVertexReader(vertexData, "texcoord")
+
+            firstRow = len(positions)
+
+            for row in range(vertexData.getNumRows()):
+
+                positions.append(mat.xformPoint(vertexReader.getData3f()))
+                texcoords.append(tuple(texcoordReader.getData2f()) if hasTexcoords else (0, 0))
+
+            for k in range(geom.getNumPrimitives()):
+
+                primitive = geom.getPrimitive(k)
+
+                for face in range(primitive.getNumPrimitives()):
+
+                    start = primitive.getPrimitiveStart(face)
+
+                    triangles.append(tuple(firstRow + primitive.getVertex(start + corner) for corner in range(3)))
+
+    return positions, texcoords, triangles, state
+
+def clusterVertices(positions, texcoords, triangles, resolution):
+
+    #Snap vertices to a uniform grid, merge each cell into its averaged vertex and
+    #drop the triangles that collapse
+
+    low = Vec3(*[min(p[axis] for p in positions) for axis in range(3)])
+    high = Vec3(*[max(p[axis] for p in positions) for axis in range(3)])
+
+    extent = high - low
+
+    cellSize = max(extent[0], extent[1], extent[2]) / float(resolution)
+
+    cells = {}
+    remap = []
+
+    for position, texcoord in zip(positions, texcoords):
+
+        key = tuple(int((position[axis] - low[axis]) / cellSize) for axis in range(3))
+
+        cell = cells.get(key)
+
+        if cell is None:
+
+            cell = cells[key] = [len(cells), Vec3(0, 0, 0), [0.0, 0.0], 0]
+
+        cell[1] += position
+        cell[2][0] += texcoord[0]
+        cell[2][1] += texcoord[1]
+        cell[3] += 1
+
+        remap.append(cell[0])
+
+    clusteredPositions = [None] * len(cells)
+    clusteredTexcoords = [None] * len(cells)
+
+    for index, total, (u, v), count in cells.values():
+
+        clusteredPositions[index] = total / count
+        clusteredTexcoords[index] = (u / count, v / count)
+
+    clusteredTriangles = []
+    seen = set()
+
+    for a, b, c in triangles:
+
+        a, b, c = remap[a], remap[b], remap[c]
+
+        if a == b or b == c or a == c: continue
+
+        key = tuple(sorted((a, b, c)))
+
+        if key in seen: continue
+
+        seen.add(key)
+
+        clusteredTriangles.append((a, b, c))
+
+    return clusteredPositions, clusteredTexcoords, clusteredTriangles
+
+def buildGeomNode(name, positions, texcoords, triangles, state):
+
+    normals = [Vec3(0, 0, 0) for position in positions]
+
+    for a, b, c in triangles:
+
+        faceNormal = (positions[b] - positions[a]).cross(positions[c] - positions[a])
+
+        for index in (a, b, c): normals[index] += faceNormal
+
+    vertexData = GeomVertexData(name, GeomVertexFormat.getV3n3t2(), Geom.UHStatic)
+    vertexData.setNumRows(len(positions))
+
+    vertexWriter = GeomVertexWriter(vertexData, "vertex")
+    normalWriter = GeomVertexWriter(vertexData, "normal")
+    texcoordWriter = GeomVertexWriter(vertexData, "texcoord")
+
+    for position, normal, texcoord in zip(positions, normals, texcoords):
+
+        normal.normalize()
+
+        vertexWriter.addData3f(position)
+        normalWriter.addData3f(normal)
+        texcoordWriter.addData2f(*texcoord)
+
+    primitive = GeomTriangles(Geom.UHStatic)
+
+    for a, b, c in triangles: primitive.addVertices(a, b, c)
+
+    geom = Geom(vertexData)
+    geom.addPrimitive(primitive)
+
+    node = GeomNode(name)
+    node.addGeom(geom, state)
+
+    return node
+
+def renderImpostor(model, outputPath):
+
+    #Orthographic front view, looking down +Y like the SPACE camera, on a transparent background
+
+    bounds = model.getBounds()
+    center = bounds.getCenter()
+    radius = bounds.getRadius()
+
+    properties = FrameBufferProperties()
+    properties.setRgbaBits(8, 8, 8, 8)
+    properties.setDepthBits(16)
+
+    texture = Texture()
+
+    buffer = base.win.makeTextureBuffer("impostor", IMPOSTOR_SIZE, IMPOSTOR_SIZE, texture, True, properties)
+    buffer.setClearColor(Vec4(0, 0, 0, 0))
+
+    scene = NodePath("impostorScene")
+    model.instanceTo(scene)
+
+    lens = OrthographicLens()
+    lens.setFilmSize(2 * radius, 2 * radius)
+    lens.setNearFar(radius, 3 * radius)
+
+    cameraNP = scene.attachNewNode(Camera("impostorCamera", lens))
+    cameraNP.setPos(center - Vec3(0, 2 * radius, 0))
+
+    buffer.makeDisplayRegion().setCamera(cameraNP)
+
+    #The first frame only sets the buffer up
+
+    base.graphicsEngine.renderFrame()
+    base.graphicsEngine.renderFrame()
+
+    texture.write(Filename(outputPath))
+
+    base.graphicsEngine.removeWindow(buffer)
+
+    scene.removeNode()
+
+def generateLOD(modelPath):
+
+    model = loader.loadModel(modelPath)
+    model.flattenStrong()
+
+    positions, texcoords, triangles, state = readTriangles(model)
+
+    print "%s: %d triangles" % (modelPath, len(triangles))
+
+    for level, resolution in enumerate(LOD_RESOLUTIONS):
+
+        lodPositions, lodTexcoords, lodTriangles = clusterVertices(positions, texcoords, triangles, resolution)
+
+        node = buildGeomNode("lod%d" % (level + 1), lodPositions, lodTexcoords, lodTriangles, state)
+
+        NodePath(node).writeBamFile(lodPath(modelPath, level + 1))
+
+        print "  lod%d: %d triangles -> %s" % (level + 1, len(lodTriangles), lodPath(modelPath, level + 1))
+
+    renderImpostor(model, impostorPath(modelPath))
+
+    print "  impostor -> %s" % impostorPath(modelPath)
+
+    model.removeNode()
+
+for modelPath in (sys.argv[1:] or MODELS):
+
+    generateLOD(modelPath)
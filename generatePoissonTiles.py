@@ -0,0 +1,130 @@
+import sys
+from array import array
+from math import sqrt, pi, sin, cos, floor
+from random import random, seed
+
+#Offline generation of tileable Poisson-disk point tiles for asteroid spawning:
+#
+#   python generatePoissonTiles.py [spacing ...]
+#
+#Writes tiles/poisson_<spacing>.bin for each minimum spacing (world units). A file holds
+#a little-endian int32 header [tileSize, spacing, tileCount, count0, count1, ...] followed
+#by float32 points, four per asteroid: x and y inside the tile, a depth jitter in [-1, 1)
+#and a variant in [0, 1) used to pick the model. Tiles wrap in both directions, so they
+#can be laid edge to edge without breaking the spacing. Needs no Panda3D.
+
+TILE_SIZE = 32
+TILE_COUNT = 4
+
+SPACINGS = range(1, 13)
+
+CANDIDATES = 30
+
+def wrappedDistanceSquared(a, b, size):
+
+    dx = abs(a[0] - b[0])
+    dy = abs(a[1] - b[1])
+
+    dx = min(dx, size - dx)
+    dy = min(dy, size - dy)
+
+    return dx*dx + dy*dy
+
+def poissonTile(size, spacing):
+
+    #Bridson's dart throwing on a torus
+
+    cellSize = spacing / sqrt(2)
+    cells = int(size / cellSize)
+    cellSize = size / float(cells)
+
+    grid = {}
+    points = []
+    active = []
+
+    def insert(point):
+
+        grid[(int(point[0] / cellSize), int(point[1] / cellSize))] = point
+
+        points.append(point)
+        active.append(point)
+
+    def fits(point):
+
+        cx = int(point[0] / cellSize)
+        cy = int(point[1] / cellSize)
+
+        for i in range(cx - 2, cx + 3):
+
+            for j in range(cy - 2, cy + 3):
+
+                neighbour = grid.get((i % cells, j % cells))
+
+                if neighbour is not None and wrappedDistanceSquared(point, neighbour, size) < spacing * spacing:
+
+                    return False
+
+        return True
+
+    insert((random() * size, random() * size))
+
+    while active:
+
+        index = int(random() * len(active))
+        origin = active[index]
+
+        for attempt in range(CANDIDATES):
+
+            angle = 2 * pi * random()
+            radius = spacing * (1 + random())
+
+            point = ((origin[0] + radius * cos(angle)) % size, (origin[1] + radius * sin(angle)) % size)
+
+            if fits(point):
+
+                insert(point)
+
+                break
+
+        else:
+
+            active[index] = active[-1]
+            active.pop()
+
+    return points
+
+def writeTiles(path, size, spacing, tiles):
+
+    header = array("i", [size, spacing, len(tiles)] + [len(tile) for tile in tiles])
+
+    points = array("f")
+
+    for tile in tiles:
+
+        for x, y in tile:
+
+            points.extend((x, y, 2 * random() - 1, random()))
+
+    if sys.byteorder == "big":
+
+        header.byteswap()
+        points.byteswap()
+
+    output = open(path, "wb")
+
+    header.tofile(output)
+    points.tofile(output)
+
+    output.close()
+
+seed(1)
+
+for spacing in [int(arg) for arg in sys.argv[1:]] or SPACINGS:
+
+    tiles = [poissonTile(TILE_SIZE, spacing) for i in range(TILE_COUNT)]
+
+    path = "tiles/poisson_%d.bin" % spacing
+
+    writeTiles(path, TILE_SIZE, spacing, tiles)
+
+    print "%s: %s points per tile" % (path, ", ".join(str(len(tile)) for tile in tiles))
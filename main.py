@@ -1,9 +1,12 @@
 from math import pi, sin, cos, radians, log, sqrt
 from random import randint, choice, random
 from time import clock
-from sys import exit
+from sys import exit, argv, byteorder
+from array import array
+import gc
  
 from direct.showbase.ShowBase import ShowBase
+from direct.showbase.DirectObject import DirectObject
 from direct.task import Task
 from direct.actor.Actor import Actor
 from direct.interval.IntervalGlobal import Sequence
@@ -15,379 +18,2449 @@ from pandac.PandaModules import WindowProperties
 from pandac.PandaModules import TextureStage, Texture
 from pandac.PandaModules import TexGenAttrib
 
-from panda3d.core import Point3, BitMask32, Vec3
+from panda3d.core import Point3, BitMask32, Vec3, Quat
 from panda3d.core import CollisionTraverser, CollisionNode, CollisionHandlerFloor
-from panda3d.core import CollisionHandlerEvent, CollisionSphere, CollisionRay
+from panda3d.core import CollisionHandlerQueue, CollisionSphere, CollisionRay
+from panda3d.core import CollisionSegment, CollisionTube
 from panda3d.core import GeoMipTerrain, loadPrcFileData
-from panda3d.core import Fog
+from panda3d.core import Fog, BoundingSphere, RigidBodyCombiner
+from panda3d.core import Shader, Vec4, LODNode, CardMaker, TransparencyAttrib, Mat4
+from panda3d.core import NodePath, Geom, GeomNode, GeomLines, GeomVertexData, GeomVertexFormat
+from panda3d.core import OmniBoundingVolume
 
-from panda3d.core import ClockObject
+#Display modes
+
+MAIN_MENU = 0
+PLAY = 1
+IN_GAME_MENU = 2
+DEAD = 3
+
+#Play modes
+
+TERRAIN = 0
+SPACE = 1
+
+LEVEL = 1
+
+#Input action bits
+
+KEY_FORWARD = 1 << 0
+KEY_BACK = 1 << 1
+KEY_LEFT = 1 << 2
+KEY_RIGHT = 1 << 3
+KEY_JUMP = 1 << 4
+KEY_ESCAPE = 1 << 5
+KEY_DEBUG_DRAW = 1 << 6
+
+KEY_BINDINGS_FILE = "keybindings.cfg"
+
+#Into-mask bits of collision geometry; CollisionDispatcher routes contacts to handlers by these
+
+CATEGORY_GROUND = 1 << 0
+CATEGORY_CAMERA_OCCLUDER = 1 << 1
+CATEGORY_ASTEROID = 1 << 2
+
+GRAPHICS_SETTINGS = {"ast_rotation": True, "ast_lod": True}
+
+#Per-level overrides of DEFAULT_LEVEL_SETTINGS, keyed by level number
+#asteroid_rows: "nodes" keeps one node per asteroid, "combined" groups each spawned
+#row under a RigidBodyCombiner
+#frustum_margin: world units of slack around the camera view when spawning and culling
+#asteroid_spacing: minimum distance between asteroids in a row, picks tiles/poisson_<n>.bin;
+#None picks the tiles whose density matches the old grid at the level's succession interval
+
+DEFAULT_LEVEL_SETTINGS = {"asteroid_rows": "nodes", "frustum_margin": 6, "asteroid_spacing": None}
+
+LEVEL_SETTINGS = {2.5: {"asteroid_rows": "combined"}}
+
+def levelSetting(level, key):
+
+    return LEVEL_SETTINGS.get(level, {}).get(key, DEFAULT_LEVEL_SETTINGS[key])
+
+#debug_draw: collider wireframes can be toggled with the debugDraw key; without the flag
+#the layer is never built
+
+#leak_cycle: reload a fixed list of levels on a timer and report leak counts at every
+#boundary, so a run shows whether they stay flat; implies leak_check
+
+DEBUG_SETTINGS = {"profile": "--profile" in argv, "debug_draw": "--debug-draw" in argv,
+                  "leak_check": "--leak-check" in argv or "--leak-cycle" in argv,
+                  "leak_cycle": "--leak-cycle" in argv}
+
+#Continuous collisions sweep the avatar's body sphere over each frame's relative motion
+#instead of testing only where things ended up
+
+COLLISION_SETTINGS = {"continuous": "--discrete-collisions" not in argv}
+
+#Frame stages run in this order each frame, all on the main thread: collision moves the
+#avatar and fills the camera's queue while simulation and presentation use both, and
+#Python stages would gain nothing from a worker thread while they hold the GIL
+
+TASK_CHAIN_SETTINGS = {"order": ("input", "simulation", "collision", "presentation")}
+
+BALLS = True
+
+class FrameProfiler(object):
+
+    REPORT_INTERVAL = 120
+
+    def __init__(self, enabled):
+
+        self.enabled = enabled
+
+        self.reset()
+
+    def reset(self):
+
+        self.frames = 0
+        self.sectionTimes = {}
+        self.sectionStarts = {}
+        self.counters = {}
+        self.counts = {}
+
+    def start(self, section):
+
+        if self.enabled: self.sectionStarts[section] = clock()
+
+    def stop(self, section):
+
+        if self.enabled:
+
+            elapsed = clock() - self.sectionStarts[section]
+
+            self.sectionTimes[section] = self.sectionTimes.get(section, 0) + elapsed
+
+    def setCounter(self, name, value):
+
+        if self.enabled: self.counters[name] = value
+
+    def addCount(self, name, value):
+
+        #Summed over the report interval and printed as a per-frame average
+
+        if self.enabled: self.counts[name] = self.counts.get(name, 0) + value
+
+    def startFrameTiming(self):
+
+        #Bracket every main-thread task that runs before igLoop renders the frame
+
+        if not self.enabled: return
+
+        taskMgr.add(self.beginMainThreadFrame, "profilerFrameBegin", sort = -1000)
+        taskMgr.add(self.endMainThreadFrame, "profilerFrameEnd", sort = 49)
+
+    def beginMainThreadFrame(self, task):
+
+        self.start("mainThread")
+
+        return task.cont
+
+    def endMainThreadFrame(self, task):
+
+        self.stop("mainThread")
+
+        self.sectionTimes["frame"] = self.sectionTimes.get("frame", 0) + globalClock.getDt()
+
+        self.endFrame()
+
+        return task.cont
+
+    def endFrame(self):
+
+        if not self.enabled: return
+
+        self.frames += 1
+
+        if self.frames < FrameProfiler.REPORT_INTERVAL: return
+
+        #Average milliseconds per frame for each section, latest value for counters and
+        #per-frame average for counts
+
+        report = ["%s %.3fms" % (section, 1000.0 * total / self.frames)
+                  for section, total in sorted(self.sectionTimes.items())]
+        report += ["%s %s" % (name, value) for name, value in sorted(self.counters.items())]
+        report += ["%s %.2f/frame" % (name, float(total) / self.frames) for name, total in sorted(self.counts.items())]
+
+        print "[profile]", ", ".join(report)
+
+        self.reset()
+
+class LeakDetector(object):
+
+    #Counts what is left between unloading one level and loading the next; over a long
+    #session every snapshot should match the first one
+
+    #Levels visited by a leak cycle, covering both play modes, and how often the list repeats
+
+    CYCLE_LEVELS = (1.5, 1, 2.5, 2)
+    CYCLE_ROUNDS = 3
+    CYCLE_INTERVAL = 2.0
+
+    def __init__(self, enabled):
+
+        self.enabled = enabled
+
+        self.baseline = None
+
+        self.cycleLevels = []
+
+    def snapshot(self, traverser):
+
+        gameObjects = sum(1 for obj in gc.get_objects() if isinstance(obj, GameObject))
+
+        return (("nodes", render.findAllMatches("**").getNumPaths()),
+                ("collisionNodes", render.findAllMatches("**/+CollisionNode").getNumPaths()),
+                ("colliders", traverser.getNumColliders()),
+                ("forceNodes", render.findAllMatches("**/+ForceNode").getNumPaths()),
+                ("tasks", len(taskMgr.getTasks())),
+                ("gameObjects", gameObjects))
+
+    def check(self, label, traverser):
+
+        if not self.enabled: return
+
+        counts = self.snapshot(traverser)
+
+        if self.baseline is None: self.baseline = counts
+
+        report = ["%s %d (%+d)" % (name, value, value - baseValue)
+                  for (name, value), (baseName, baseValue) in zip(counts, self.baseline)]
+
+        print "[leaks] %s: %s" % (label, ", ".join(report))
+
+        if any(value > baseValue for (name, value), (baseName, baseValue) in zip(counts, self.baseline)):
+
+            print "[leaks] %s: counts grew since the first level boundary" % label
+
+    def startCycle(self, game):
+
+        self.cycleLevels = list(LeakDetector.CYCLE_LEVELS) * LeakDetector.CYCLE_ROUNDS
+
+        taskMgr.doMethodLater(LeakDetector.CYCLE_INTERVAL, self.nextCycleLevel, "leakCycle", extraArgs=[game], appendTask=True)
+
+    def nextCycleLevel(self, game, task):
+
+        if not self.cycleLevels:
+
+            print "[leaks] cycle finished"
+
+            return Task.done
+
+        game.level = self.cycleLevels.pop(0)
+
+        #Through resetLevel, so a death or an open menu does not stall the cycle
+
+        game.resetLevel()
+
+        return Task.again
+
+class InputState(DirectObject):
+
+    ACTIONS = {"forward" : KEY_FORWARD, "back" : KEY_BACK, "left" : KEY_LEFT,
+               "right" : KEY_RIGHT, "jump" : KEY_JUMP, "menu" : KEY_ESCAPE,
+               "debugDraw" : KEY_DEBUG_DRAW}
+
+    DEFAULT_BINDINGS = {"forward" : "w", "back" : "s", "left" : "a",
+                        "right" : "d", "jump" : "space", "menu" : "escape",
+                        "debugDraw" : "f3"}
+
+    def __init__(self, bindingsFile=None):
+
+        self.held = 0
+
+        #Press/release edges since the last popEdges, as (action bit, pressed) pairs
+
+        self.edges = []
+
+        self.bindings = {}
+
+        #The action each bound key drives; a key drives at most one action
+
+        self.boundKeys = {}
+
+        fileBindings = self.loadBindings(bindingsFile) if bindingsFile is not None else {}
+
+        for action, key in InputState.DEFAULT_BINDINGS.items():
+
+            if action not in fileBindings: self.bind(action, key)
+
+        #A configured key that clashes with another action falls back to the default
+
+        for action, key in fileBindings.items():
+
+            if not self.bind(action, key): self.bind(action, InputState.DEFAULT_BINDINGS[action])
+
+    def loadBindings(self, bindingsFile):
+
+        bindings = {}
+
+        try:
+
+            lines = open(bindingsFile).readlines()
+
+        except IOError:
+
+            return bindings
+
+        for line in lines:
+
+            line = line.split("#")[0].strip()
+
+            if not line: continue
+
+            #Only the first "=" separates, so "=" itself can be bound
+
+            action, separator, key = [part.strip() for part in line.partition("=")]
+
+            if not separator or not action or not key:
+
+                print "Malformed input binding in %s: %s" % (bindingsFile, line)
+
+            elif action not in InputState.ACTIONS:
+
+                print "Unknown input action in %s: %s" % (bindingsFile, action)
+
+            elif key in bindings.values():
+
+                print "Duplicate input key in %s: %s is already bound, %s skipped" % (bindingsFile, key, action)
+
+            else:
+
+                bindings[action] = key
+
+        return bindings
+
+    def bind(self, action, key):
+
+        #Returns False without changing anything when key already drives another action
+
+        owner = self.boundKeys.get(key)
+
+        if owner is not None and owner != action:
+
+            print "Input key %s is bound to %s, not rebinding it to %s" % (key, owner, action)
+
+            return False
+
+        bit = InputState.ACTIONS[action]
+
+        oldKey = self.bindings.get(action)
+
+        if oldKey is not None:
+
+            self.ignore(oldKey)
+            self.ignore(oldKey + "-up")
+
+            self.release(bit)
+
+            del self.boundKeys[oldKey]
+
+        self.bindings[action] = key
+        self.boundKeys[key] = action
+
+        self.accept(key, self.press, [bit])
+        self.accept(key + "-up", self.release, [bit])
+
+        return True
+
+    def press(self, bit):
+
+        if not self.held & bit:
+
+            self.held |= bit
+            self.edges.append((bit, True))
+
+    def release(self, bit):
+
+        if self.held & bit:
+
+            self.held &= ~bit
+            self.edges.append((bit, False))
+
+    def popEdges(self):
+
+        edges = self.edges
+
+        self.edges = []
+
+        return edges
+
+    def destroy(self):
+
+        self.ignoreAll()
+
+class DebugDraw(object):
+
+    #Wireframes of every collision solid in the scene, written into one dynamic GeomLines
+    #once per frame; while off there is no task and the node is out of the scene graph
+
+    SEGMENTS = 12
+    RAY_LENGTH = 10
+
+    def __init__(self, stages):
+
+        self.stages = stages
+
+        self.task = None
+
+        self.vertexData = GeomVertexData("debugDraw", GeomVertexFormat.getV3(), Geom.UHDynamic)
+
+        self.lines = GeomLines(Geom.UHDynamic)
+        self.numVertices = 0
+
+        geom = Geom(self.vertexData)
+        geom.addPrimitive(self.lines)
+
+        geomNode = GeomNode("debugDraw")
+        geomNode.addGeom(geom)
+
+        #Rewritten every frame, so never cull it on stale bounds
+
+        geomNode.setBounds(OmniBoundingVolume())
+        geomNode.setFinal(True)
+
+        self.nodePath = NodePath(geomNode)
+        self.nodePath.setColor(0, 1, 0, 1)
+        self.nodePath.setLightOff()
+        self.nodePath.setShaderOff()
+        self.nodePath.setBin("fixed", 0)
+        self.nodePath.setDepthTest(False)
+        self.nodePath.setDepthWrite(False)
+
+        #Three unit great circles as line endpoint pairs
+
+        self.unitSphere = []
+
+        for i in range(DebugDraw.SEGMENTS):
+
+            start = 2*pi*i/DebugDraw.SEGMENTS
+            end = 2*pi*(i + 1)/DebugDraw.SEGMENTS
+
+            for circle in (lambda c, s: Vec3(c, s, 0), lambda c, s: Vec3(c, 0, s), lambda c, s: Vec3(0, c, s)):
+
+                self.unitSphere += [circle(cos(start), sin(start)), circle(cos(end), sin(end))]
+
+    def toggle(self):
+
+        if self.task is None: self.enable()
+
+        else: self.disable()
+
+    def enable(self):
+
+        self.nodePath.reparentTo(render)
+
+        self.task = self.stages.add(self.update, "debugDraw", "presentation")
+
+    def disable(self):
+
+        taskMgr.remove(self.task)
+
+        self.task = None
+
+        self.nodePath.detachNode()
+
+    def sphereLines(self, mat, center, radius, points):
+
+        for offset in self.unitSphere:
+
+            points.append(mat.xformPoint(center + offset * radius))
+
+    def solidLines(self, mat, solid, points):
+
+        if isinstance(solid, CollisionSphere):
+
+            self.sphereLines(mat, solid.getCenter(), solid.getRadius(), points)
+
+        elif isinstance(solid, CollisionTube):
+
+            pointA, pointB, radius = solid.getPointA(), solid.getPointB(), solid.getRadius()
+
+            self.sphereLines(mat, pointA, radius, points)
+            self.sphereLines(mat, pointB, radius, points)
+
+            axis = pointB - pointA
+            axis.normalize()
+
+            side = axis.cross(Vec3(0, 0, 1) if abs(axis[2]) < .9 else Vec3(1, 0, 0))
+            side.normalize()
+
+            for offset in (side, -side, axis.cross(side), -axis.cross(side)):
+
+                points += [mat.xformPoint(pointA + offset * radius), mat.xformPoint(pointB + offset * radius)]
+
+        elif isinstance(solid, CollisionRay):
+
+            points += [mat.xformPoint(solid.getOrigin()),
+                       mat.xformPoint(solid.getOrigin() + solid.getDirection() * DebugDraw.RAY_LENGTH)]
+
+        elif isinstance(solid, CollisionSegment):
+
+            points += [mat.xformPoint(solid.getPointA()), mat.xformPoint(solid.getPointB())]
+
+    def update(self, task):
+
+        points = []
+
+        collisionNodes = render.findAllMatches("**/+CollisionNode")
+
+        for i in range(collisionNodes.getNumPaths()):
+
+            nodePath = collisionNodes.getPath(i)
+
+            mat = nodePath.getMat(render)
+
+            node = nodePath.node()
+
+            for j in range(node.getNumSolids()):
+
+                self.solidLines(mat, node.getSolid(j), points)
+
+        vertices = array("f")
+
+        for point in points: vertices.extend((point[0], point[1], point[2]))
+
+        self.vertexData.uncleanSetNumRows(len(points))
+        self.vertexData.modifyArray(0).modifyHandle().setData(vertices.tostring())
+
+        if len(points) != self.numVertices:
+
+            self.lines.clearVertices()
+            self.lines.addConsecutiveVertices(0, len(points))
+
+            self.numVertices = len(points)
+
+        return Task.cont
+
+    def destroy(self):
+
+        if self.task is not None: self.disable()
+
+        self.nodePath.removeNode()
+
+class MouseLook(object):
+
+    EDGE_MARGIN = 5
+
+    def __init__(self, window):
+
+        self.window = window
+
+        self.enabled = False
+
+        #None until the window reports which pointer mode it actually granted
+
+        self.relative = None
+
+        self.lastX = 0
+        self.lastY = 0
+
+        self.deltaX = 0
+        self.deltaY = 0
+
+    def enable(self):
+
+        #Relative mode lets the pointer accumulate motion without bound, so it never
+        #needs recentering; platforms without it fall back to a confined pointer
+
+        props = WindowProperties()
+        props.setCursorHidden(True)
+        props.setMouseMode(WindowProperties.MRelative)
+
+        self.window.requestProperties(props)
+
+        self.enabled = True
+        self.relative = None
+
+        self.resync()
+
+    def disable(self):
+
+        props = WindowProperties()
+        props.setCursorHidden(False)
+        props.setMouseMode(WindowProperties.MAbsolute)
+
+        self.window.requestProperties(props)
+
+        self.enabled = False
+
+    def resync(self):
+
+        pointer = self.window.getPointer(0)
+
+        self.lastX = pointer.getX()
+        self.lastY = pointer.getY()
+
+        self.deltaX = 0
+        self.deltaY = 0
+
+    def checkGrantedMode(self):
+
+        if self.window.getRequestedProperties().hasMouseMode(): return
+
+        mode = self.window.getProperties().getMouseMode()
+
+        if mode == WindowProperties.MRelative:
+
+            self.relative = True
+
+        elif not self.window.getProperties().hasMouseMode() or mode == WindowProperties.MAbsolute:
+
+            props = WindowProperties()
+            props.setMouseMode(WindowProperties.MConfined)
+
+            self.window.requestProperties(props)
+
+            self.relative = False
+
+    def sample(self):
+
+        #Motion gathered by the window since the last frame; read once per frame
+
+        if not self.enabled: return
+
+        if self.relative is None: self.checkGrantedMode()
+
+        pointer = self.window.getPointer(0)
+
+        x = pointer.getX()
+        y = pointer.getY()
+
+        self.deltaX = x - self.lastX
+        self.deltaY = y - self.lastY
+
+        self.lastX = x
+        self.lastY = y
+
+        if self.relative: return
+
+        #Confined fallback: recentre only once the pointer reaches an edge, after the
+        #delta for this frame has already been taken
+
+        margin = MouseLook.EDGE_MARGIN
+
+        props = self.window.getProperties()
+
+        if x < margin or y < margin or x > props.getXSize() - margin or y > props.getYSize() - margin:
+
+            centerX = props.getXSize() / 2
+            centerY = props.getYSize() / 2
+
+            if self.window.movePointer(0, centerX, centerY):
+
+                self.lastX = centerX
+                self.lastY = centerY
+
+def sceneGraphStats(nodePath):
+
+    geomNodes = nodePath.findAllMatches("**/+GeomNode")
+
+    numGeoms = sum(geomNodes.getPath(i).node().getNumGeoms() for i in range(geomNodes.getNumPaths()))
+
+    return nodePath.findAllMatches("**").getNumPaths(), numGeoms
+
+def triangleCount(nodePath):
+
+    geomNodes = nodePath.findAllMatches("**/+GeomNode")
+
+    total = 0
+
+    for i in range(geomNodes.getNumPaths()):
+
+        node = geomNodes.getPath(i).node()
+
+        for j in range(node.getNumGeoms()):
+
+            geom = node.getGeom(j)
+
+            total += sum(geom.getPrimitive(k).getNumFaces() for k in range(geom.getNumPrimitives()))
+
+    return total
+
+def flattenStatic(nodePath, label):
+
+    #Collapse static geometry at load time, merging nodes and Geoms that share render state,
+    #so cull traversal and draw calls stay cheap every frame
+
+    nodesBefore, geomsBefore = sceneGraphStats(nodePath)
+
+    nodePath.flattenStrong()
+
+    nodesAfter, geomsAfter = sceneGraphStats(nodePath)
+
+    if DEBUG_SETTINGS["profile"]:
+
+        print "[flatten] %s: nodes %d -> %d, geoms %d -> %d" % (label, nodesBefore, nodesAfter,
+                                                             geomsBefore, geomsAfter)
+
+class ModelCache(object):
+
+    #Loads and flattens each static model once; callers get copies of the flattened template
+
+    def __init__(self):
+
+        self.templates = {}
+        self.levels = {}
+        self.volumes = {}
+
+        #(modelPath, kind) pairs already warned about
+
+        self.warned = set()
+
+    def warnOnce(self, modelPath, kind, message):
+
+        if (modelPath, kind) in self.warned: return
+
+        self.warned.add((modelPath, kind))
+
+        print "ModelCache: %s" % message
+
+    def copy(self, modelPath, lodSwitches=None):
+
+        #With lodSwitches the template is an LODNode over the full model, the decimated
+        #levels written by generateAsteroidLOD.py and a billboard impostor, switched by
+        #camera distance; lodSwitches lists (far, near) distances for each of those in order
+
+        key = modelPath if lodSwitches is None else (modelPath, lodSwitches)
+
+        template = self.templates.get(key)
+
+        if template is None:
+
+            model = loader.loadModel(modelPath)
+
+            flattenStatic(model, modelPath)
+
+            if lodSwitches is None:
+
+                template = model
+
+                self.levels[key] = [(float("inf"), 0, triangleCount(model))]
+
+            else:
+
+                template = self.buildLOD(modelPath, model, lodSwitches)
+
+            self.templates[key] = template
+
+        return template.copyTo(render)
+
+    def buildLOD(self, modelPath, model, lodSwitches):
+
+        levels = [model]
+
+        for level in range(1, len(lodSwitches) - 1):
+
+            decimated = loader.loadModel("%s_lod%d.bam" % (modelPath, level), okMissing=True)
+
+            if decimated is None: break
+
+            levels.append(decimated)
+
+        else:
+
+            impostorTexture = loader.loadTexture("%s_impostor.png" % modelPath, okMissing=True)
+
+            if impostorTexture is not None: levels.append(self.buildImpostor(model, impostorTexture))
+
+        switches = list(lodSwitches[:len(levels)])
+
+        if len(levels) < len(lodSwitches):
+
+            self.warnOnce(modelPath, "lod", "%s has %d of %d LOD levels, run generateAsteroidLOD.py" % (modelPath, len(levels), len(lodSwitches)))
+
+            #The coarsest level found covers the rest of the range
+
+            switches[-1] = (lodSwitches[-1][0], switches[-1][1])
+
+        lodNode = LODNode("lod")
+        template = NodePath(lodNode)
+
+        self.levels[(modelPath, lodSwitches)] = []
+
+        for levelNP, (far, near) in zip(levels, switches):
+
+            lodNode.addSwitch(far, near)
+
+            levelNP.reparentTo(template)
+
+            self.levels[(modelPath, lodSwitches)].append((far, near, triangleCount(levelNP)))
+
+        return template
+
+    def buildImpostor(self, model, texture):
+
+        bounds = model.getBounds()
+        center = bounds.getCenter()
+        radius = bounds.getRadius()
+
+        cardMaker = CardMaker("impostor")
+        cardMaker.setFrame(-radius, radius, -radius, radius)
+
+        impostor = NodePath("impostorRoot")
+        impostor.setPos(center)
+
+        card = impostor.attachNewNode(cardMaker.generate())
+        card.setTexture(texture)
+        card.setTransparency(TransparencyAttrib.MAlpha)
+        card.setBillboardPointEye()
+
+        #Under the asteroid spin shader a card may only turn in its own plane
+
+        card.setShaderInput("spin", Vec4(0, 1, 0, radians(3)))
+
+        return impostor
+
+    def triangles(self, modelPath, lodSwitches, distance):
+
+        #Triangles a copy submits at the given camera distance
+
+        for far, near, count in self.levels[modelPath if lodSwitches is None else (modelPath, lodSwitches)]:
+
+            if near <= distance < far: return count
+
+        return 0
+
+    def collisionSolids(self, modelPath):
+
+        #Solids fitted offline by fitCollisionVolumes.py and stored as <model>.bounds, shared
+        #by the CollisionNode of every copy; None when the model has no bounds file
+
+        volumes = self.volumes.get(modelPath)
+
+        if volumes is None:
+
+            volumes = self.volumes[modelPath] = self.loadVolumes(modelPath)
+
+        if not volumes: return None
+
+        #A file without a usable preferred line falls back to the minimal sphere
+
+        return volumes.get(volumes.get("preferred")) or volumes["sphere"] or None
+
+    def loadVolumes(self, modelPath):
+
+        try:
+
+            boundsFile = open(modelPath + ".bounds")
+
+        except IOError:
+
+            self.warnOnce(modelPath, "bounds", "no %s.bounds, run fitCollisionVolumes.py" % modelPath)
+
+            return {}
+
+        volumes = {"sphere": [], "tree": [], "capsule": []}
+
+        for line in boundsFile:
+
+            fields = line.split()
+
+            if not fields: continue
+
+            if fields[0] == "preferred":
+
+                volumes["preferred"] = fields[1]
+
+            elif fields[0] == "capsule":
+
+                volumes["capsule"].append(CollisionTube(*map(float, fields[1:8])))
+
+            elif fields[0] in volumes:
+
+                volumes[fields[0]].append(CollisionSphere(*map(float, fields[1:5])))
+
+        boundsFile.close()
+
+        return volumes
+
+class GameObject(object):
+
+    __slots__ = ("objectNP",)
+
+    def __init__(self, objectNP):
+
+        self.objectNP = objectNP
+
+        self.objectNP.reparentTo(render)
+
+    def getWrappedSphere(self):
+
+        tightBounds = self.objectNP.getBounds()
+
+        sphereCenter = tightBounds.getCenter()
+        sphereRadius = tightBounds.getRadius()
+
+        currentPos = self.objectNP.getPos()
+
+        return CollisionSphere(sphereCenter[0] - currentPos[0], sphereCenter[1] - currentPos[1],
+                               sphereCenter[2] - currentPos[2], sphereRadius)
+
+    def destroy(self):
+
+        #Called by the owner when it drops the object, so the node leaves the scene graph
+        #right away instead of whenever the finalizer runs
+
+        self.objectNP.removeNode()
+
+class CollisionDispatcher(object):
+
+    #Each registered collider gets its own queue, so the from side needs no lookup; contacts
+    #go straight to the handlers whose category bits are set in the into node's mask. This
+    #is the one place collision results are read each frame
+
+    def __init__(self, traverser):
+
+        self.traverser = traverser
+
+        self.colliders = []
+
+    def addCollider(self, nodePath, handlers, nearest=False, idle=None):
+
+        #handlers maps CATEGORY_* bits to callables taking the CollisionEntry; with nearest
+        #each category only gets its closest contact, and idle is called without arguments
+        #on traversals where no handler ran
+
+        queue = CollisionHandlerQueue()
+
+        self.traverser.addCollider(nodePath, queue)
+
+        self.colliders.append((queue, handlers.items(), nearest, idle))
+
+    def dispatch(self):
+
+        for queue, handlers, nearest, idle in self.colliders:
+
+            if nearest: queue.sortEntries()
+
+            handled = 0
+
+            for i in range(queue.getNumEntries()):
+
+                entry = queue.getEntry(i)
+
+                intoBits = entry.getIntoNode().getIntoCollideMask().getWord()
+
+                for category, handler in handlers:
+
+                    if intoBits & category and not (nearest and handled & category):
+
+                        handler(entry)
+
+                        handled |= category
+
+            if not handled and idle is not None: idle()
+
+class KinematicController(object):
+
+    GRAVITY = -9.81
+    JUMP_SPEED = 6.5
+
+    STEP_HEIGHT = .6
+    MAX_SLOPE = 1.2
+    SNAP_DIST = .3
+
+    RAY_HEIGHT = 3
+
+    COLLISION_NAME = "playerGroundRay"
+
+    def __init__(self, objectNP, dispatcher, groundCategory):
+
+        self.objectNP = objectNP
+
+        #A single downward ray is the only ground query made each tick
+
+        self.groundRay = CollisionRay(0, 0, KinematicController.RAY_HEIGHT, 0, 0, -1)
+
+        groundRayNode = CollisionNode(KinematicController.COLLISION_NAME)
+        groundRayNode.addSolid(self.groundRay)
+        groundRayNode.setFromCollideMask(BitMask32(groundCategory))
+        groundRayNode.setIntoCollideMask(BitMask32.allOff())
+
+        self.groundRayNodepath = self.objectNP.attachNewNode(groundRayNode)
+
+        dispatcher.addCollider(self.groundRayNodepath, {groundCategory : self.resolveGround},
+                               nearest=True, idle=self.loseGround)
+
+        self.verticalSpeed = 0
+        self.grounded = False
+
+        self.groundListener = None
+
+        self.lastPos = self.objectNP.getPos()
+        self.lastGroundZ = None
+
+    def destroy(self):
+
+        self.groundRayNodepath.removeNode()
+
+        self.groundListener = None
+
+    def setGroundListener(self, listener):
+
+        self.groundListener = listener
+
+    def setGrounded(self, grounded):
+
+        if grounded != self.grounded:
+
+            self.grounded = grounded
+
+            if self.groundListener is not None: self.groundListener(grounded)
+
+    def jump(self):
+
+        if self.grounded:
+
+            self.verticalSpeed = KinematicController.JUMP_SPEED
+            self.grounded = False
+
+    def move(self, speed, dt):
+
+        self.lastPos = self.objectNP.getPos()
+
+        if not self.grounded:
+
+            self.verticalSpeed += KinematicController.GRAVITY * dt
+
+        newPos = render.getRelativePoint(self.objectNP, Point3(speed[0]*dt, speed[1]*dt, 0))
+        newPos.setZ(self.lastPos.getZ() + self.verticalSpeed*dt)
+
+        self.objectNP.setFluidPos(newPos)
+
+        #Rays are not swept, so start this one above where the avatar was before a long
+        #fall or it could begin below the ground it passed through
+
+        self.groundRay.setOrigin(0, 0, KinematicController.RAY_HEIGHT + max(0, self.lastPos.getZ() - newPos.getZ()))
+
+    def loseGround(self):
+
+        #Dispatched when the ground ray hit nothing this tick
+
+        self.setGrounded(False)
+
+    def resolveGround(self, entry):
+
+        #Dispatched with the nearest ground under the ray this tick
+
+        groundZ = entry.getSurfacePoint(render).getZ()
+
+        pos = self.objectNP.getPos()
+
+        if self.grounded and self.lastGroundZ is not None:
+
+            rise = groundZ - self.lastGroundZ
+            run = (pos.getXy() - self.lastPos.getXy()).length()
+
+            if rise > KinematicController.STEP_HEIGHT + KinematicController.MAX_SLOPE * run:
+
+                #Too steep to climb, stay where we were last tick
+
+                self.objectNP.setPos(self.lastPos)
+
+                return
+
+        if self.verticalSpeed <= 0 and pos.getZ() - groundZ <= KinematicController.SNAP_DIST:
+
+            self.objectNP.setZ(groundZ)
+
+            self.verticalSpeed = 0
+            self.lastGroundZ = groundZ
+
+            self.setGrounded(True)
+
+        else:
+
+            self.setGrounded(False)
+
+class Avatar(GameObject):
+
+    GROUNDED = 0
+    JUMPING = 1
+    FALLING = 2
+    DEAD = 3
+
+    SPACE_SPEED = -8
+
+    #Per play mode: axis driven by forward/back, forward and strafe acceleration,
+    #speed bound per axis and the fixed cruise speed along Y (None when steered)
+
+    MODE_LIMITS = {TERRAIN : (1, 5, 1, Vec3(5, 15, 0), None),
+                   SPACE : (2, -1, -1, Vec3(5, abs(SPACE_SPEED), 5), SPACE_SPEED)}
+
+    AXES = (0, 1, 2)
+
+    __slots__ = ("speed", "yawRot", "state", "controller", "forwardAxis", "forwardAcceleration",
+                 "strafeAcceleration", "speedBound", "cruiseSpeed")
+
+    def __init__(self, objectNP, playMode):
+
+        GameObject.__init__(self, objectNP)
+
+        self.controller = None
+
+        self.reset()
+
+        self.setPlayMode(playMode)
+
+    def reset(self):
+
+        self.speed = Vec3(0, 0, 0)
+
+        self.yawRot = 0
+
+        self.state = Avatar.FALLING
+
+    def destroy(self):
+
+        if self.controller is not None:
+
+            self.controller.destroy()
+
+            self.controller = None
+
+        GameObject.destroy(self)
+
+    def setPlayMode(self, playMode):
+
+        self.forwardAxis, self.forwardAcceleration, self.strafeAcceleration, \
+            self.speedBound, self.cruiseSpeed = Avatar.MODE_LIMITS[playMode]
+
+    def attachController(self, controller):
+
+        self.controller = controller
+
+        controller.setGroundListener(self.handleGroundContact)
+
+    def isAlive(self):
+
+        return self.state != Avatar.DEAD
+
+    def move(self, dt):
+
+        if self.controller is not None:
+
+            self.controller.move(self.speed, dt)
+
+            if self.state == Avatar.JUMPING and self.controller.verticalSpeed <= 0:
+
+                self.state = Avatar.FALLING
+
+        else:
+
+            self.objectNP.setPos(self.objectNP, self.speed[0]*dt, self.speed[1]*dt, self.speed[2]*dt)
+
+    def handleKeys(self, held):
+
+        speed = self.speed
+
+        speed[self.forwardAxis] += ((held & KEY_FORWARD > 0) - (held & KEY_BACK > 0)) * self.forwardAcceleration
+        speed[0] += ((held & KEY_RIGHT > 0) - (held & KEY_LEFT > 0)) * self.strafeAcceleration
+
+        if self.cruiseSpeed is not None:
+
+            speed[1] = self.cruiseSpeed
+
+        speedBound = self.speedBound
+
+        for i in Avatar.AXES:
+
+            bound = speedBound[i]
+
+            if speed[i] > bound: speed[i] = bound
+
+            elif speed[i] < -bound: speed[i] = -bound
+
+        if held & KEY_JUMP and self.state == Avatar.GROUNDED:
+
+            self.controller.jump()
+
+            self.state = Avatar.JUMPING
+
+    def applyFriction(self, friction):
+
+        for component, i in enumerate(friction):
+
+            self.speed[i] -= component
+
+    def handleGroundContact(self, grounded):
+
+        if self.state == Avatar.DEAD: return
+
+        if grounded:
+
+            self.state = Avatar.GROUNDED
+
+        elif self.state == Avatar.GROUNDED:
+
+            self.state = Avatar.FALLING
+
+    def handleAsteroidContact(self, entry):
+
+        self.state = Avatar.DEAD
+
+class ModelReference(object):
+
+    def __init__(self, modelPath, radialScale):
+
+        self.modelPath = modelPath
+        self.radialScale = radialScale
+
+class Asteroid(GameObject):
+
+    ASTEROID_MODELS = [ModelReference("models/Asteroid_2", .66),
+                       ModelReference("models/Asteroid_3", .66)]
+
+    COLLISION_NAME = "asteroid"
+
+    #(far, near) camera distances for the full mesh, the two generated decimations and the
+    #impostor; the field spans roughly 16 to 55 units from the SPACE camera
+
+    LOD_SWITCHES = ((25, 0), (35, 25), (45, 35), (10000, 45))
+
+    def __init__(self, objectNP, position, transMag, spinMag):
+
+        GameObject.__init__(self, objectNP)
+
+        self.objectNP.setPos(position[0], position[1], position[2])
+
+        self.transSpeed = Vec3(transMag*random(), transMag*random(), transMag*random())
+
+        #Spin is applied by the asteroidSpin vertex shader; spinMag is in degrees per second
+
+        spinAxis = Vec3(random() - .5, random() - .5, random() - .5)
+
+        if not spinAxis.normalize(): spinAxis = Vec3(0, 0, 1)
+
+        self.spin = Vec4(spinAxis[0], spinAxis[1], spinAxis[2], radians(spinMag*random()))
+
+        self.collisionNP = None
+
+    def orient(self):
+
+        self.objectNP.setHpr(360*random(), 360*random(), 360*random())
+
+    def enableSpin(self):
+
+        self.objectNP.setShaderInput("spin", self.spin)
+
+    def alignCollision(self, fieldTime):
+
+        #Turn the collision solids to where the spin shader has turned the mesh, about the
+        #same model-space origin and axis
+
+        quat = Quat()
+        quat.setFromAxisAngleRad(self.spin[3] * fieldTime, Vec3(self.spin[0], self.spin[1], self.spin[2]))
+
+        self.collisionNP.setQuat(quat)
+
+    def move(self, dt):
+
+        #Avatar-relative motion is carried by the field root, only the drift is per asteroid
+
+        self.objectNP.setFluidPos(self.objectNP.getX() + self.transSpeed[0]*dt, 
+                                  self.objectNP.getY() + self.transSpeed[1]*dt,
+                                  self.objectNP.getZ() + self.transSpeed[2]*dt)
+
+def readTileHeader(tileFile):
+
+    #(tile size, spacing, points per tile) from the start of a tiles/poisson_<n>.bin file
+
+    header = array("i")
+    header.fromfile(tileFile, 3)
+
+    if byteorder == "big": header.byteswap()
+
+    size, spacing, tileCount = header
+
+    counts = array("i")
+    counts.fromfile(tileFile, tileCount)
+
+    if byteorder == "big": counts.byteswap()
+
+    return size, spacing, counts
+
+def matchingTileSpacing(density):
+
+    #The shipped spacing whose tiles hold closest to density asteroids per square unit
+
+    best, bestError = None, None
+
+    for spacing in PoissonTileSet.SPACINGS:
+
+        tileFile = open(PoissonTileSet.PATH % spacing, "rb")
+
+        size, spacing, counts = readTileHeader(tileFile)
+
+        tileFile.close()
+
+        error = abs(sum(counts) / float(len(counts) * size * size) - density)
+
+        if best is None or error < bestError: best, bestError = spacing, error
+
+    return best
+
+class PoissonTileSet(object):
+
+    #Tileable Poisson-disk points written by generatePoissonTiles.py; every tile is a slice
+    #of one flat float array of (x, y, depth jitter, variant) quadruples
+
+    PATH = "tiles/poisson_%d.bin"
+
+    SPACINGS = range(1, 13)
+
+    def __init__(self, spacing):
+
+        tileFile = open(PoissonTileSet.PATH % spacing, "rb")
+
+        self.size, self.spacing, counts = readTileHeader(tileFile)
+
+        self.points = array("f")
+        self.points.fromfile(tileFile, 4 * sum(counts))
+
+        if byteorder == "big": self.points.byteswap()
+
+        tileFile.close()
+
+        self.slices = []
+
+        start = 0
+
+        for count in counts:
+
+            self.slices.append((4 * start, 4 * (start + count)))
+
+            start += count
+
+        self.nextTile = 0
+
+    def place(self, colStart, colEnd, rowStart, rowEnd):
+
+        #Lays the next tile edge to edge over the rectangle, anchored to multiples of the
+        #tile size, and returns (col, row, depth jitter, variant) for every point inside
+
+        start, end = self.slices[self.nextTile]
+
+        self.nextTile = (self.nextTile + 1) % len(self.slices)
+
+        tile = self.points[start:end]
+
+        size = self.size
+
+        placed = []
+
+        tileCol = int(colStart // size) * size
+
+        while tileCol <= colEnd:
+
+            tileRow = int(rowStart // size) * size
+
+            while tileRow <= rowEnd:
+
+                for i in range(0, len(tile), 4):
+
+                    col = tileCol + tile[i]
+                    row = tileRow + tile[i + 1]
+
+                    if colStart <= col <= colEnd and rowStart <= row <= rowEnd:
+
+                        placed.append((col, row, tile[i + 2], tile[i + 3]))
+
+                tileRow += size
+
+            tileCol += size
+
+        return placed
+
+class AsteroidRow(object):
+
+    #Asteroids spawned together render as a handful of Geoms through a RigidBodyCombiner,
+    #while each asteroid keeps its own transform
+
+    def __init__(self, parent):
+
+        self.rootNP = parent.attachNewNode(RigidBodyCombiner("asteroidRow"))
+
+        self.count = 0
+
+        self.dirty = False
+
+    def add(self, asteroid):
+
+        asteroid.objectNP.reparentTo(self.rootNP)
+
+        asteroid.row = self
+
+        self.count += 1
+
+    def release(self):
+
+        self.count -= 1
+
+        self.dirty = True
+
+    def collect(self):
+
+        self.rootNP.node().collect()
+
+        self.dirty = False
+
+    def destroy(self):
+
+        self.rootNP.removeNode()
+
+class AsteroidManager(object):
+
+    REBASE_DISTANCE = 1024
+
+    SPIN_SHADER = ("shaders/asteroidSpin.vert", "shaders/asteroidSpin.frag")
+
+    #Under shader spin, only asteroids whose bounds come within this many world units of
+    #the avatar get their collision solids turned to match each frame
+
+    SPIN_COLLISION_MARGIN = 4
+
+    def __init__(self, modelCache):
+
+        self.modelCache = modelCache
+
+        self.axis_index_dic = {"X" : 0, "Y" : 1, "Z" : 2}
+
+        self.asteroids = []
+
+        self.rows = []
+
+        #The field scrolls past the stationary avatar as a whole; asteroids live in
+        #field-local coordinates under this root
+
+        self.fieldRoot = render.attachNewNode("asteroidField")
+        self.fieldOffset = Vec3(0, 0, 0)
+
+        self.fieldTime = 0.0
+        self.spinShader = None
+
+        self.spawned = 0
+        self.culled = 0
+
+    def initialize(self, level, avatarNP):
+
+        self.combineRows = levelSetting(level, "asteroid_rows") == "combined"
+
+        #A RigidBodyCombiner would merge every LOD level into the row, so LOD needs plain nodes
+
+        self.lodSwitches = Asteroid.LOD_SWITCHES if GRAPHICS_SETTINGS["ast_lod"] and not self.combineRows else None
+
+        #Combined rows bake asteroid vertices into row space, so the shader could not
+        #spin them about their own origins
+
+        if GRAPHICS_SETTINGS["ast_rotation"] and not self.combineRows:
+
+            self.spinShader = Shader.load(Shader.SL_GLSL, AsteroidManager.SPIN_SHADER[0], AsteroidManager.SPIN_SHADER[1])
+
+            self.fieldRoot.setShader(self.spinShader)
+            self.fieldRoot.setShaderInput("fieldTime", self.fieldTime)
+
+            #Fog is off during play; the in-game menu overrides this on render
+
+            render.setShaderInput("fogEnabled", 0.0)
+
+        breadth_bound, depth_bound, height_bound = 10, 28, 15
+
+        self.field_expanse = ((-breadth_bound, breadth_bound), (0, depth_bound), 
+                              (-height_bound, height_bound))
+
+        difficulty_factor = 1.0 / (log(level))
+
+        self.succession_interval = (int(5 * difficulty_factor), int(5 * difficulty_factor), 
+                                    int(5 * difficulty_factor))
+
+        self.deviation_factor = 5
+
+        self.tiles = PoissonTileSet(levelSetting(level, "asteroid_spacing") or matchingTileSpacing(self.gridDensity()))
+
+        self.buffer = self.succession_interval[0] + self.deviation_factor + 1
+
+        #World units added around every asteroid before testing it against the view, so
+        #drift and strafing do not uncover empty space
+
+        self.margin = levelSetting(level, "frustum_margin")
+
+        self.viewFrustum = self.buildViewFrustum(avatarNP)
+
+        #Field-local coordinate of the outermost succession spawned on each side of each axis
+
+        self.frontiers = [list(bounds) for bounds in self.field_expanse]
+
+        self.updateLocalExpanse()
+
+        distance = 0
+
+        while distance < self.field_expanse[2][1]:
+
+            #Each initial succession gets its own depth, so tiles never overlap in one plane
+
+            self.genSuccession("Y", self.field_expanse[self.axis_index_dic["Y"]][1] - distance)
+
+            distance += self.succession_interval[self.axis_index_dic["Y"]]
+
+    def gridDensity(self):
+
+        #Asteroids per square unit of a Y succession on the grid rows used to be laid on:
+        #one per succession interval from the near edge up to one step past the far edge
+
+        area = 1.0
+        count = 1
+
+        for axis in ("X", "Z"):
+
+            low, high = self.field_expanse[self.axis_index_dic[axis]]
+            interval = max(1, self.succession_interval[self.axis_index_dic[axis]])
+
+            count *= -(-(high - low) // interval) + 1
+            area *= high - low
+
+        return count / area
+
+    def buildViewFrustum(self, avatarNP):
+
+        #The SPACE camera rests AVATAR_DIST behind the avatar and only pitches, so everything
+        #it can show lies in the lens frustum widened by the pitch range, placed at that pose
+
+        lens = base.camLens.makeCopy()
+
+        fov = lens.getFov()
+
+        lens.setFov(fov[0], fov[1] + 2 * CameraRig.FLEX_ROT_BOUND[0])
+
+        frustum = lens.makeBounds()
+
+        frustum.xform(Mat4.translateMat(avatarNP.getPos(render) + Vec3(0, -CameraRig.AVATAR_DIST, CameraRig.ELEVATION)))
+
+        return frustum
+
+    def updateLocalExpanse(self):
+
+        self.local_expanse = tuple((low - self.fieldOffset[i], high - self.fieldOffset[i])
+                                   for i, (low, high) in enumerate(self.field_expanse))
+
+        self.frustum = self.viewFrustum.makeCopy()
+        self.frustum.xform(Mat4.translateMat(-self.fieldOffset))
+
+    def visible(self, position, radius):
+
+        return self.frustum.contains(BoundingSphere(position, radius + self.margin)) != 0
+
+    def rebase(self):
+
+        #Fold the accumulated field offset back into the asteroids so local coordinates
+        #stay small over long runs
+
+        for asteroid in self.asteroids:
+
+            asteroid.objectNP.setPos(asteroid.objectNP.getPos() + self.fieldOffset)
+
+        #A plain setPos also drops the root's previous transform, so nothing sweeps across the jump
+
+        self.fieldRoot.setPos(0, 0, 0)
+
+        for i, frontier in enumerate(self.frontiers):
+
+            frontier[0] += self.fieldOffset[i]
+            frontier[1] += self.fieldOffset[i]
+
+        self.fieldOffset = Vec3(0, 0, 0)
+
+    def genSuccession(self, axis, distance, direction=None):
+
+        #distance is field-local along axis
+
+        axis_index = (self.axis_index_dic[axis])
+        col_index = (self.axis_index_dic[axis] + 1) % len(self.axis_index_dic)
+        row_index = (self.axis_index_dic[axis] + 2) % len(self.axis_index_dic)
+
+        ast_location = []
+
+        row = AsteroidRow(self.fieldRoot) if self.combineRows else None
+
+        col_start, col_end = self.local_expanse[col_index]
+        row_start, row_end = self.local_expanse[row_index]
+
+        for ast_column, ast_row, jitter, variant in self.tiles.place(col_start, col_end, row_start, row_end):
+
+            ast_location = [0, 0, 0]
+
+            ast_location[axis_index] = distance + jitter * self.deviation_factor
+            ast_location[col_index] = ast_column
+            ast_location[row_index] = ast_row
+
+            if not self.visible(Point3(*ast_location), 0): continue
+
+            model_ref = Asteroid.ASTEROID_MODELS[int(variant * len(Asteroid.ASTEROID_MODELS))]
+            asteroid = Asteroid(self.modelCache.copy(model_ref.modelPath, self.lodSwitches), ast_location, 1, 6)
+            asteroid.modelPath = model_ref.modelPath
+            asteroid.objectNP.reparentTo(self.fieldRoot)
+
+            bound = asteroid.objectNP.getBounds()
+            bound_center = bound.getCenter()
+            bound_radius = bound.getRadius()
+
+            asteroidSphereNode = CollisionNode(Asteroid.COLLISION_NAME)
+
+            solids = self.modelCache.collisionSolids(model_ref.modelPath)
+
+            if solids is None:
+
+                #No fitted volumes, fall back to the shrunken render bounds
+
+                solids = [CollisionSphere(bound_center[0] - asteroid.objectNP.getX(), bound_center[1] - asteroid.objectNP.getY(), 
+                                          bound_center[2] - asteroid.objectNP.getZ(), bound_radius*model_ref.radialScale)]
+
+            for solid in solids: asteroidSphereNode.addSolid(solid)
+
+            asteroidSphereNode.setFromCollideMask(BitMask32.allOff())
+            asteroidSphereNode.setIntoCollideMask(BitMask32(CATEGORY_ASTEROID))
+
+            asteroid.collisionNP = asteroid.objectNP.attachNewNode(asteroidSphereNode)
+
+            asteroid.radius = bound_radius
+
+            asteroid.orient()
+
+            if self.spinShader is not None:
+
+                asteroid.enableSpin()
+
+                asteroid.alignCollision(self.fieldTime)
+
+            if row is not None: row.add(asteroid)
+
+            self.asteroids.append(asteroid)
+
+            self.spawned += 1
+
+        if row is not None:
+
+            if row.count == 0:
+
+                row.destroy()
+
+            else:
+
+                row.collect()
+
+                self.rows.append(row)
+
+    def inView(self, asteroid):
+
+        position = asteroid.objectNP.getPos()
+
+        expanse = self.local_expanse
+
+        if position[0] < expanse[0][0] - self.buffer or position[0] > expanse[0][1] + self.buffer or \
+            position[2] < expanse[2][0] - self.buffer or position[2] > expanse[2][1] + self.buffer:
+
+            return False
+
+        return self.visible(position, asteroid.radius)
+
+    def maintainAsteroidField(self, avatarPosition, avatarSpeed, dt):
+
+        self.spawned = 0
+        self.culled = 0
+
+        #One transform write carries the shared avatar-relative motion of the whole field
+
+        self.fieldOffset += avatarSpeed * dt
+
+        if max(abs(self.fieldOffset[0]), abs(self.fieldOffset[1]), abs(self.fieldOffset[2])) > AsteroidManager.REBASE_DISTANCE:
+
+            self.rebase()
+
+        #Fluid moves keep last frame's transform for the swept collision test
+
+        self.fieldRoot.setFluidPos(self.fieldOffset)
+
+        #Spin time only advances with the simulation, so it stops while paused
+
+        if self.spinShader is not None:
+
+            self.fieldTime += dt
+
+            self.fieldRoot.setShaderInput("fieldTime", self.fieldTime)
+
+        self.updateLocalExpanse()
+
+        visible = []
+
+        for asteroid in self.asteroids:
+
+            if self.inView(asteroid):
+
+                visible.append(asteroid)
+
+                continue
+
+            self.culled += 1
+
+            if self.combineRows: asteroid.row.release()
+
+            asteroid.destroy()
+
+        self.asteroids = visible
+
+        if self.combineRows: self.collectRows()
+
+        for asteroid in self.asteroids: asteroid.move(dt)
+
+        if self.spinShader is not None: self.alignNearbyCollisions(avatarPosition, avatarSpeed, dt)
+
+        for i, axis in enumerate(("X", "Y", "Z")):
+
+            low, high = self.local_expanse[i]
+
+            frontier = self.frontiers[i]
+
+            #A receding side only keeps what survives culling, so its frontier follows the cull line
+
+            frontier[0] = max(frontier[0], low - self.buffer)
+            frontier[1] = min(frontier[1], high + self.buffer)
+
+            #New successions enter on the side the field is moving away from
+
+            if avatarSpeed[i] > 0:
+
+                while frontier[0] > low:
+
+                    frontier[0] -= self.succession_interval[i]
+
+                    self.genSuccession(axis, frontier[0], -1)
+
+            else:
+
+                while frontier[1] < high:
+
+                    frontier[1] += self.succession_interval[i]
+
+                    self.genSuccession(axis, frontier[1], 1)
+
+    def alignNearbyCollisions(self, avatarPosition, avatarSpeed, dt):
+
+        #Only solids the avatar could reach this frame need to follow the spin; the rest
+        #are turned when they come close
+
+        avatarLocal = avatarPosition - self.fieldOffset
+
+        reach = AsteroidManager.SPIN_COLLISION_MARGIN + avatarSpeed.length() * dt
+
+        for asteroid in self.asteroids:
+
+            if (asteroid.objectNP.getPos() - avatarLocal).length() < asteroid.radius + reach:
+
+                asteroid.alignCollision(self.fieldTime)
+
+    def submittedTriangles(self, cameraNP):
+
+        #Asteroid triangles handed to the renderer at the current LOD levels, before
+        #frustum culling; one distance query per asteroid, so only used when profiling
+
+        return sum(self.modelCache.triangles(asteroid.modelPath, self.lodSwitches, asteroid.objectNP.getDistance(cameraNP))
+                   for asteroid in self.asteroids)
+
+    def collectRows(self):
+
+        #Rebuild only rows that lost asteroids this frame, and drop rows that emptied
+
+        for row in self.rows:
+
+            if row.dirty and row.count > 0: row.collect()
+
+            elif row.count == 0: row.destroy()
+
+        self.rows = [row for row in self.rows if row.count > 0]
+
+    def destroy(self):
+
+        #Rows and asteroids all hang off the field root
+
+        self.fieldRoot.removeNode()
+
+        self.asteroids = []
+        self.rows = []
+
+class Turret(GameObject):
+
+    def __init__(self):
+
+        GameObject.__init__(self)
+
+class CameraRig(object):
+
+    ROT_RATE = (.4, .25)
+    ELEVATION = 6.5
+    AVATAR_DIST = 20
+
+    MIN_ARM_LENGTH = 2
+    OCCLUSION_PADDING = .5
+
+    #Fraction of the remaining arm extension recovered per second once the view is clear
+
+    EXTEND_RATE = 4.0
+
+    MIN_PITCH_ROT = -20
+    MAX_PITCH_ROT = 20
+
+    FLEX_ROT_BOUND = (20, 20)
+
+    COLLISION_NAME = "cameraArm"
+
+    def __init__(self, cameraObject):
+
+        self.camObject = cameraObject
+
+        self.pitchRot = 0
+
+        self.armLength = CameraRig.AVATAR_DIST
+        self.currentArmLength = self.armLength
+
+        self.pivot = None
+
+        #Distance along the arm to the nearest occluder from the last collision pass, None when clear
+
+        self.occlusionDist = None
+
+        self.task = None
+
+    def attach(self, targetNP, dispatcher, occluderCategory):
+
+        #The pivot inherits the target's position and heading, so the camera only
+        #needs its own arm offset and pitch written each frame
+
+        self.pivot = targetNP.attachNewNode("cameraPivot")
+        self.pivot.setZ(CameraRig.ELEVATION)
+
+        self.camObject.reparentTo(self.pivot)
+
+        self.armSegment = CollisionSegment(0, 0, 0, 0, -self.armLength, 0)
+
+        armNode = CollisionNode(CameraRig.COLLISION_NAME)
+        armNode.addSolid(self.armSegment)
+        armNode.setFromCollideMask(BitMask32(occluderCategory))
+        armNode.setIntoCollideMask(BitMask32.allOff())
+
+        self.armNodepath = self.pivot.attachNewNode(armNode)
+
+        dispatcher.addCollider(self.armNodepath, {occluderCategory : self.handleOcclusion},
+                               nearest=True, idle=self.clearOcclusion)
+
+        self.occlusionDist = None
+
+        self.currentArmLength = self.armLength
+
+        self.camObject.setPosHpr(0, -self.currentArmLength, 0, 0, self.pitchRot, 0)
+
+    def detach(self):
+
+        if self.pivot is None: return
+
+        self.stop()
+
+        self.camObject.wrtReparentTo(render)
+
+        self.pivot.removeNode()
+
+        self.pivot = None
+        self.occlusionDist = None
+
+    def start(self, stages):
+
+        self.task = stages.add(self.update, "cameraRig", "presentation")
+
+    def stop(self):
+
+        if self.task is not None:
+
+            taskMgr.remove(self.task)
+
+            self.task = None
+
+    def zoom(self, direction):
+
+        self.armLength = max(CameraRig.MIN_ARM_LENGTH, self.armLength + direction)
+
+        self.armSegment.setPointB(0, -self.armLength, 0)
+
+    def addPitch(self, pitchShift):
+
+        self.pitchRot += pitchShift
+
+        if self.pitchRot > CameraRig.FLEX_ROT_BOUND[0]:
+
+            self.pitchRot = CameraRig.FLEX_ROT_BOUND[0]
+
+        elif self.pitchRot < -CameraRig.FLEX_ROT_BOUND[0]:
+
+            self.pitchRot = -CameraRig.FLEX_ROT_BOUND[0]
+
+    def handleOcclusion(self, entry):
+
+        self.occlusionDist = -entry.getSurfacePoint(self.pivot).getY()
+
+    def clearOcclusion(self):
+
+        self.occlusionDist = None
+
+    def update(self, task):
+
+        targetLength = self.armLength
+
+        if self.occlusionDist is not None:
+
+            #Pull in in front of whatever terrain blocks the arm
+
+            targetLength = max(CameraRig.MIN_ARM_LENGTH, min(targetLength, self.occlusionDist - CameraRig.OCCLUSION_PADDING))
+
+        if targetLength < self.currentArmLength:
+
+            self.currentArmLength = targetLength
+
+        else:
+
+            self.currentArmLength += (targetLength - self.currentArmLength) * min(1.0, CameraRig.EXTEND_RATE * globalClock.getDt())
+
+        self.camObject.setPosHpr(0, -self.currentArmLength, 0, 0, self.pitchRot, 0)
+
+        return Task.cont
+
+class FrameStages(object):
+
+    #Maps each named stage of the frame to a sort value in stage order
+
+    FIRST_SORT = 1
+    STAGE_SPACING = 10
+
+    def __init__(self, order):
+
+        self.taskArgs = {}
+
+        for index, stage in enumerate(order):
+
+            self.taskArgs[stage] = {"sort" : FrameStages.FIRST_SORT + index * FrameStages.STAGE_SPACING}
+
+    def add(self, func, name, stage, **extraArgs):
+
+        taskArgs = dict(self.taskArgs[stage])
+        taskArgs.update(extraArgs)
+
+        return taskMgr.add(func, name, **taskArgs)
+
+class TaskGroup(object):
+
+    #Tasks that are suspended and resumed together; a suspended task is taken off the
+    #manager entirely, so it costs nothing while paused and resumes with its state intact
+
+    def __init__(self, name, stages):
+
+        self.name = name
+        self.stages = stages
+
+        self.tasks = []
+
+        self.suspended = False
+
+    def add(self, func, name, stage):
+
+        task = self.stages.add(func, name, stage)
+
+        if self.suspended: taskMgr.remove(task)
+
+        self.tasks.append(task)
+
+        return task
+
+    def suspend(self):
+
+        if self.suspended: return
+
+        for task in self.tasks:
+
+            taskMgr.remove(task)
+
+        self.suspended = True
+
+    def resume(self):
+
+        if not self.suspended: return
 
-from panda3d.physics import *
+        for task in self.tasks:
 
-#Display modes
+            taskMgr.add(task)
 
-MAIN_MENU = 0
-PLAY = 1
-IN_GAME_MENU = 2
-DEAD = 3
+        self.suspended = False
 
-#Play modes
+    def clear(self):
 
-TERRAIN = 0
-SPACE = 1
+        for task in self.tasks:
 
-LEVEL = 1
+            taskMgr.remove(task)
 
-GRAPHICS_SETTINGS = {"ast_rotation": True}
+        self.tasks = []
 
-BALLS = True
+        self.suspended = False
 
-class GameObject(object):
+class ParticleBudgetManager(object):
 
-    def __init__(self, objectNP):
+    #Owns every particle effect, shares one global live-particle budget between the
+    #enabled ones, and steps them from its own task only while any are enabled
 
-        self.objectNP = objectNP
+    MAX_LIVE_PARTICLES = 1500
 
-        self.objectNP.reparentTo(render)
+    CULL_INTERVAL = 10
+    CULL_RADIUS = 5
 
-    def getWrappedSphere(self):
+    def __init__(self, stages, profiler):
 
-        tightBounds = self.objectNP.getBounds()
+        self.stages = stages
+        self.profiler = profiler
 
-        sphereCenter = tightBounds.getCenter()
-        sphereRadius = tightBounds.getRadius()
+        #ShowBase sets up the particle and physics managers; their stepping moves here
 
-        currentPos = self.objectNP.getPos()
+        base.enableParticles()
+        taskMgr.remove("manager-update")
 
-        return CollisionSphere(sphereCenter[0] - currentPos[0], sphereCenter[0] -currentPos[1],
-                               sphereCenter[0] - currentPos[2], sphereRadius)
+        self.effects = {}
+        self.requestedPoolSizes = {}
 
-    def __del__(self):
+        self.enabled = []
+        self.culled = []
 
-        for child in self.objectNP.getChildren():
+        self.frame = 0
 
-            child.removeNode()
+        self.task = None
 
-        self.objectNP.removeNode()
+    def start(self, name, build, parent, pos):
 
-class Avatar(GameObject):
+        effect = self.effects.get(name)
 
-    LAND_GAP_PERMISSION = 5
+        if effect is None:
 
-    def __init__(self, objectNP, level):
+            effect = self.effects[name] = build()
 
-        GameObject.__init__(self, objectNP)
+            self.requestedPoolSizes[name] = [particles.getPoolSize() for particles in effect.getParticlesList()]
 
-        self.reset()
+        if effect in self.enabled: return effect
 
-        self.calcLimits(level)
+        #Grant what is left of the budget, up to the effect's requested pool sizes
 
-    def reset(self):
+        remaining = ParticleBudgetManager.MAX_LIVE_PARTICLES - self.allocatedParticles()
 
-        self.speed = Vec3(0, 0, 0)
+        for particles, requested in zip(effect.getParticlesList(), self.requestedPoolSizes[name]):
 
-        self.yawRot = 0
+            granted = max(0, min(requested, remaining))
 
-        self.landed = False
-        self.landGap = 0
-        self.jumpThrusting = False
-        self.jumpThrustInterval = 10 
-        self.jumpThrustCounter = self.jumpThrustInterval
+            particles.setPoolSize(granted)
 
-        self.states = {"alive" : True}
+            remaining -= granted
 
-    def calcLimits(self, level):
+        effect.reparentTo(parent)
+        effect.setPos(pos)
+        effect.enable()
 
-        self.SPACE_SPEED = -8
+        self.enabled.append(effect)
 
-        self.maxVelocityTerrain = (5, 15, 0)
-        self.maxVelocitySpace = (5, self.SPACE_SPEED , 5)
+        if self.task is None:
 
-        self.accelerationTerrain = (1, 5, 0)
-        self.accelerationSpace = (-1, 0, -1)
+            self.task = self.stages.add(self.update, "particles", "presentation")
 
-    def move(self, dt):
+        return effect
 
-        self.objectNP.setPos(self.objectNP, self.speed[0]*dt, self.speed[1]*dt, self.speed[2]*dt)
+    def stop(self, name):
 
-        if self.jumpThrusting:
+        effect = self.effects.get(name)
 
-            self.landed = False
+        if effect is None: return
 
-            if self.jumpThrustCounter < self.jumpThrustInterval:
+        if effect in self.enabled:
 
-                self.jumpThrustCounter += 1
+            effect.disable()
 
-            else:
+            self.enabled.remove(effect)
 
-                self.objectNP.node().getPhysical(0).removeLinearForce(self.jumpThrustForce)
+        if effect in self.culled: self.culled.remove(effect)
 
-                self.jumpThrusting = False
+        if not self.enabled and not self.culled and self.task is not None:
 
-    def handleKeys(self, keys, play_mode):
+            taskMgr.remove(self.task)
 
-        if play_mode == TERRAIN:
+            self.task = None
 
-            if keys["w"]: self.speed[1] += self.accelerationTerrain[1]
-            if keys["s"]: self.speed[1] += -self.accelerationTerrain[1]
-            if keys["a"]: self.speed[0] += -self.accelerationTerrain[0]
-            if keys["d"]: self.speed[0] += self.accelerationTerrain[0]
+    def allocatedParticles(self):
 
-            speedBound = self.maxVelocityTerrain
+        return sum(particles.getPoolSize() for effect in self.enabled + self.culled
+                   for particles in effect.getParticlesList())
 
-        elif play_mode == SPACE:
+    def liveParticles(self):
 
-            if keys["w"]: self.speed[2] += self.accelerationSpace[2]
-            if keys["s"]: self.speed[2] += -self.accelerationSpace[2]
-            if keys["a"]: self.speed[0] += -self.accelerationSpace[0]
-            if keys["d"]: self.speed[0] += self.accelerationSpace[0]
+        return sum(particles.getLivingParticles() for effect in self.enabled
+                   for particles in effect.getParticlesList())
 
-            self.speed[1] = self.SPACE_SPEED
+    def inView(self, effect):
 
-            speedBound = self.maxVelocitySpace
+        bounds = BoundingSphere(effect.getPos(base.cam), ParticleBudgetManager.CULL_RADIUS)
 
-        for i, bound in enumerate(speedBound):
+        return base.camLens.makeBounds().contains(bounds) != 0
 
-            if abs(self.speed[i]) > bound:
+    def cull(self):
 
-                closerBound = min((-bound, bound), key=lambda x: abs(self.speed[i]-x))
+        for effect in list(self.enabled):
 
-                self.speed[i] = closerBound
+            if not self.inView(effect):
 
-        if keys["space"]:
+                effect.disable()
 
-            if self.landed and self.jumpThrustCounter == self.jumpThrustInterval and \
-                           not self.jumpThrusting:
+                self.enabled.remove(effect)
+                self.culled.append(effect)
 
-                    self.landed = False
-                    self.jumpThrusting = True
-                    self.jumpThrustCounter = 0
+        for effect in list(self.culled):
 
-                    self.jumpThrustForce = LinearVectorForce(0, 0, 50)
-                    self.jumpThrustForce.setMassDependent(False)
-                    thrustFN = ForceNode("world-forces")
-                    thrustFN.addForce(self.jumpThrustForce)
+            if self.inView(effect):
 
-                    self.objectNP.node().getPhysical(0).addLinearForce(self.jumpThrustForce)
+                effect.enable()
 
-        if self.landGap >= Avatar.LAND_GAP_PERMISSION: self.landed = False
+                self.culled.remove(effect)
+                self.enabled.append(effect)
 
-        elif self.landGap > 0: self.landGap += 1
+    def update(self, task):
 
-    def applyFriction(self, friction):
+        self.frame += 1
 
-        for component, i in enumerate(friction):
+        if self.frame % ParticleBudgetManager.CULL_INTERVAL == 0: self.cull()
 
-            self.speed[i] -= component
+        dt = globalClock.getDt()
 
-    def handleCollisionEvent(self, type, event):
+        self.profiler.start("particles")
 
-        collisionRecipient = event.getIntoNodePath().getName()
+        base.particleMgr.doParticles(dt)
+        base.physicsMgr.doPhysics(dt)
 
-        if type == "in":
+        self.profiler.stop("particles")
 
-            if collisionRecipient.startswith("Ground"):
+        if self.profiler.enabled: self.profiler.setCounter("liveParticles", self.liveParticles())
 
-                self.landed = True
+        return Task.cont
 
-                self.landGap = 0
+    def destroy(self):
 
-            if collisionRecipient == Asteroid.COLLISION_NAME:
+        for effect in self.effects.values():
 
-                self.states["alive"] = False
+            effect.cleanup()
 
-        elif type == "out" and collisionRecipient.startswith("Ground"):
+        self.effects = {}
+        self.enabled = []
+        self.culled = []
 
-            self.landGap = 1
+        if self.task is not None:
 
-class ModelReference(object):
+            taskMgr.remove(self.task)
 
-    def __init__(self, modelPath, radialScale):
+            self.task = None
 
-        self.modelPath = modelPath
-        self.radialScale = radialScale
+class ScreenCache(object):
 
-class Asteroid(GameObject):
+    #Each GUI screen is built the first time it is shown, then only hidden and shown
+    #again, and destroyed once when the game shuts down
 
-    ASTEROID_MODELS = [ModelReference("models/Asteroid_2", .66),
-                       ModelReference("models/Asteroid_3", .66)]
+    def __init__(self):
 
-    COLLISION_NAME = "asteroid"
+        self.screens = {}
 
-    def __init__(self, objectNP, position, deviationMag, transMag, spinMag):
+    def show(self, screenId, build):
 
-        GameObject.__init__(self, objectNP)
+        elements = self.screens.get(screenId)
 
-        self.objectNP.setPos(position[0] + deviationMag*random()*choice([-1,1]), 
-                             position[1] + deviationMag*random()*choice([-1,1]), 
-                             position[2] + deviationMag*random()*choice([-1,1]))
+        if elements is None:
 
-        self.transSpeed = Vec3(transMag*random(), transMag*random(), transMag*random())
-        self.rotSpeed = Vec3(spinMag*random(), spinMag*random(), spinMag*random())
+            self.screens[screenId] = build()
 
-    def orient(self):
+        else:
 
-        self.objectNP.setHpr(360*random(), 360*random(), 360*random())
+            for element in elements:
 
-    def rotate(self):
+                element.show()
 
-        if GRAPHICS_SETTINGS["ast_rotation"]:
+    def hide(self, screenId):
 
-            self.objectNP.setHpr(self.objectNP, self.rotSpeed[0], 
-                    self.rotSpeed[0], self.rotSpeed[0])
+        for element in self.screens.get(screenId, ()):
 
-    def move(self, avatarSpeed, dt):
+            element.hide()
 
-        self.objectNP.setPos(self.objectNP.getX() + (self.transSpeed[0] + avatarSpeed[0])*dt, 
-                             self.objectNP.getY() + (self.transSpeed[1] + avatarSpeed[1])*dt,
-                             self.objectNP.getZ() + (self.transSpeed[2] + avatarSpeed[2])*dt)
+    def destroy(self):
 
-        self.rotate()
+        for elements in self.screens.values():
 
-class AsteroidManager(object):
+            for element in reversed(elements):
 
-    def __init__(self):
+                element.destroy()
 
-        self.axis_index_dic = {"X" : 0, "Y" : 1, "Z" : 2}
+        self.screens = {}
 
-        self.axis_control_dic = {"X" : (lambda x: x.objectNP.getX(), lambda x: x.objectNP.setX),
-                        "Y" : (lambda x: x.objectNP.getY(), lambda x: x.objectNP.setY),
-                        "Z" : (lambda x: x.objectNP.getZ(), lambda x: x.objectNP.setZ)}
+class SkyboxService(object):
 
-        self.asteroids = []
+    #A single skybox rides on the camera, so it never needs repositioning; cube maps
+    #are loaded once per path and swapped in on level change
 
-    def initialize(self, level):
+    SIZE = 100
 
-        breadth_bound, depth_bound, height_bound = 10, 28, 15
+    def __init__(self, cameraObject):
 
-        self.field_expanse = ((-breadth_bound, breadth_bound), (0, depth_bound), 
-                              (-height_bound, height_bound))
+        self.cameraObject = cameraObject
 
-        difficulty_factor = 1.0 / (log(level))
+        self.cubeMaps = {}
 
-        self.succession_interval = (int(5 * difficulty_factor), int(5 * difficulty_factor), 
-                                    int(5 * difficulty_factor))
+        self.skyBox = None
+        self.currentPath = None
 
-        self.deviation_factor = 5
+    def build(self):
 
-        distance = 0
+        self.skyBox = loader.loadModel('models/box')
+        self.skyBox.setScale(SkyboxService.SIZE)
+        self.skyBox.setBin('background', 0)
+        self.skyBox.setDepthWrite(0)
+        self.skyBox.setTwoSided(True)
+        self.skyBox.setTexGen(TextureStage.getDefault(), TexGenAttrib.MWorldCubeMap)
 
-        while distance < self.field_expanse[2][1]:
+        #models/box spans 0..1, centre it on the camera and keep it world-aligned
 
-            self.genSuccession("Y", self.field_expanse[self.axis_index_dic["Y"]][1])
+        self.skyBoxRoot = self.cameraObject.attachNewNode('skyBoxRoot')
+        self.skyBoxRoot.setCompass()
 
-            distance += self.succession_interval[self.axis_index_dic["Y"]]
+        self.skyBox.reparentTo(self.skyBoxRoot)
+        self.skyBox.setPos(-SkyboxService.SIZE/2.0, -SkyboxService.SIZE/2.0, -SkyboxService.SIZE/2.0)
 
-    def genSuccession(self, axis, distance, direction=None):
+    def show(self, cubeMapPath):
 
-        axis_index = (self.axis_index_dic[axis])
-        col_index = (self.axis_index_dic[axis] + 1) % len(self.axis_index_dic)
-        row_index = (self.axis_index_dic[axis] + 2) % len(self.axis_index_dic)
+        if self.skyBox is None: self.build()
 
-        ast_location = []
+        if cubeMapPath != self.currentPath:
 
-        for ast_column in range(self.field_expanse[col_index][0], self.field_expanse[col_index][1] + self.succession_interval[col_index], 
-                                self.succession_interval[col_index]):
+            cubeMap = self.cubeMaps.get(cubeMapPath)
 
-            for ast_row in range(self.field_expanse[row_index][0], self.field_expanse[row_index][1] + self.succession_interval[row_index], 
-                                self.succession_interval[row_index]):
+            if cubeMap is None:
 
-                ast_location = [0, 0, 0]
+                cubeMap = self.cubeMaps[cubeMapPath] = loader.loadCubeMap(cubeMapPath)
 
-                ast_location[axis_index] = distance
-                ast_location[col_index] = ast_column
-                ast_location[row_index] = ast_row
+            self.skyBox.setTexture(cubeMap, 1)
 
-                model_ref = choice(Asteroid.ASTEROID_MODELS)
-                asteroid = Asteroid(loader.loadModel(model_ref.modelPath), ast_location, self.deviation_factor, 1, .1)
+            self.currentPath = cubeMapPath
 
-                bound = asteroid.objectNP.getBounds()
-                bound_center = bound.getCenter()
-                bound_radius = bound.getRadius()
+        self.skyBoxRoot.show()
 
-                asteroidSphere = CollisionSphere(bound_center[0] - asteroid.objectNP.getX(), bound_center[1] - asteroid.objectNP.getY(), 
-                                        bound_center[2] - asteroid.objectNP.getZ(), bound_radius*model_ref.radialScale)
+    def hide(self):
 
-                asteroidSphereNode = CollisionNode(Asteroid.COLLISION_NAME)
-                asteroidSphereNode.addSolid(asteroidSphere)
+        if self.skyBox is not None: self.skyBoxRoot.hide()
 
-                asteroidSphereNode.setFromCollideMask(BitMask32.allOff())
-                asteroidSphereNode.setIntoCollideMask(BitMask32.bit(0))
+    def destroy(self):
 
-                pandaBodySphereNodepath = asteroid.objectNP.attachNewNode(asteroidSphereNode)
+        if self.skyBox is not None:
 
-                asteroid.orient()
+            self.skyBoxRoot.removeNode()
 
-                self.asteroids.append(asteroid)
+            self.skyBox = None
 
-    def inView(self, asteroid, camDist):
+        self.cubeMaps = {}
+        self.currentPath = None
 
-        BUFFER = self.succession_interval[0] + self.deviation_factor + 1
+class DisplayMode(object):
 
-        LENS_OFFSET = 4
+    #One screen of the display-mode stack; only modes with a per-frame update get a task,
+    #and it only runs while the mode is on top of the stack
 
-        if (asteroid.objectNP.getX() < self.field_expanse[0][0] - BUFFER or asteroid.objectNP.getX() > self.field_expanse[0][1] + BUFFER) or \
-            asteroid.objectNP.getY() < -camDist + LENS_OFFSET or asteroid.objectNP.getZ() < self.field_expanse[2][0] - BUFFER or \
-            (asteroid.objectNP.getZ() < self.field_expanse[2][0] - BUFFER):
+    MODE = None
+    STAGE = "input"
 
-            return False
+    def __init__(self, game):
 
-        return True
+        self.game = game
 
-    def maintainAsteroidField(self, avatarPosition, avatarSpeed, camDist, dt):
+        self.task = None
 
-        self.asteroids = filter(lambda x: self.inView(x, camDist), self.asteroids)
+    def enter(self): pass
 
-        for asteroid in self.asteroids: asteroid.move(avatarSpeed, dt)
+    def exit(self): pass
 
-        fieldSize = ((min(self.asteroids, key=self.axis_control_dic["X"][0]), max(self.asteroids, key=self.axis_control_dic["X"][0])),
-                     (max(self.asteroids, key=self.axis_control_dic["Y"][0]), ),
-                     (min(self.asteroids, key=self.axis_control_dic["Z"][0]), max(self.asteroids, key=self.axis_control_dic["Z"][0])))
+    def pause(self): pass
 
-        for i, axis in enumerate(("X", "Y", "Z")):
+    def resume(self): pass
 
-            access_func =  self.axis_control_dic[axis][0]
+    def handleInput(self, bit, pressed): pass
 
-            bound = self.field_expanse[i][0] if avatarSpeed[i] > 0 else self.field_expanse[i][1]
+    update = None
 
-            startPoint = min(map(access_func, fieldSize[i])) if bound < 0 else max(map(access_func, fieldSize[i]))
+    def startTask(self):
 
-            spawn_direction = bound/(abs(bound))
+        if self.update is not None and self.task is None:
 
-            while abs(startPoint) < abs(bound):
+            self.task = self.game.frameStages.add(self.update, "displayMode-%d" % self.MODE, self.STAGE)
 
-                startPoint += spawn_direction*self.succession_interval[i]
+    def stopTask(self):
 
-                self.genSuccession(axis, startPoint, spawn_direction)
+        if self.task is not None:
 
-    def __del__(self):
+            taskMgr.remove(self.task)
 
-        self.asteroids = []
+            self.task = None
 
-class Turret(GameObject):
+class MainMenuMode(DisplayMode):
+
+    MODE = MAIN_MENU
+
+    def enter(self):
+
+        self.game.mouseLook.disable()
+
+        self.game.screens.show(MAIN_MENU, self.game.buildMainMenu)
+
+        self.game.particles.start("mainMenu", self.game.buildMenuParticles, render, Point3(-1, 0, 0))
+
+    def exit(self):
+
+        self.game.screens.hide(MAIN_MENU)
+
+        self.game.particles.stop("mainMenu")
+
+class PlayMode(DisplayMode):
+
+    MODE = PLAY
+
+    def __init__(self, game):
+
+        DisplayMode.__init__(self, game)
+
+        self.update = game.lookLoop
+
+    def enter(self):
+
+        self.game.mouseLook.enable()
+
+        self.game.simulationTasks.add(self.game.gameLoop, "simulation", "simulation")
+        self.game.simulationTasks.add(self.game.collisionLoop, "collision", "collision")
+
+        self.startTask()
+
+    def exit(self):
+
+        self.stopTask()
+
+        self.game.simulationTasks.clear()
+
+    def pause(self):
+
+        #Only gameplay stops; menus, GUI and rendering keep running on real time
+
+        self.stopTask()
+
+        self.game.simulationTasks.suspend()
+
+    def resume(self):
+
+        self.game.simulationTasks.resume()
+
+        self.game.mouseLook.enable()
+
+        self.startTask()
+
+    def handleInput(self, bit, pressed):
+
+        if bit == KEY_ESCAPE and pressed: self.game.switchDisplayMode(IN_GAME_MENU)
+
+class InGameMenuMode(DisplayMode):
+
+    MODE = IN_GAME_MENU
+
+    def enter(self):
+
+        #Fog out background
+
+        inGameMenuFogColor = (50, 150, 50)
+
+        inGameMenuFog = Fog("inGameMenuFog")
+
+        inGameMenuFog.setMode(Fog.MExponential)
+        inGameMenuFog.setColor(*inGameMenuFogColor)
+        inGameMenuFog.setExpDensity(.01)
+
+        render.setFog(inGameMenuFog)
+
+        #Shaded asteroids only mix in p3d_Fog while this is set; without a FogAttrib
+        #Panda hands the shader placeholder fog values
+
+        render.setShaderInput("fogEnabled", 1.0)
+
+        self.game.mouseLook.disable()
+
+        self.game.screens.show(IN_GAME_MENU, self.game.buildInGameMenu)
+
+    def exit(self):
+
+        render.clearFog()
+
+        render.setShaderInput("fogEnabled", 0.0)
+
+        self.game.screens.hide(IN_GAME_MENU)
+
+    def handleInput(self, bit, pressed):
+
+        if bit == KEY_ESCAPE and pressed: self.game.switchDisplayMode(PLAY)
+
+class DeathMode(DisplayMode):
+
+    MODE = DEAD
+
+    def enter(self):
+
+        self.game.mouseLook.disable()
+
+        self.game.screens.show(DEAD, self.game.buildDeathScreen)
+
+    def exit(self):
+
+        self.game.screens.hide(DEAD)
+
+class DisplayModeStack(object):
 
     def __init__(self):
 
-        GameObject.__init__(self)
+        self.stack = []
 
-class Camera(object):
+    def top(self):
 
-    ROT_RATE = (.4, .25)
-    ELEVATION = 6.5
-    AVATAR_DIST = 20
+        return self.stack[-1] if self.stack else None
 
-    MIN_PITCH_ROT = -20
-    MAX_PITCH_ROT = 20
+    def push(self, mode):
 
-    FLEX_ROT_BOUND = (20, 20)
+        if self.stack: self.stack[-1].pause()
 
-    def __init__(self, cameraObject):
+        self.stack.append(mode)
 
-        self.camObject = cameraObject
+        mode.enter()
+
+    def pop(self):
+
+        mode = self.stack.pop()
+
+        mode.exit()
+
+        if self.stack: self.stack[-1].resume()
+
+        return mode
+
+    def switch(self, mode):
+
+        while self.stack:
+
+            self.stack.pop().exit()
+
+        self.push(mode)
 
-        self.pitchRot = 0
- 
 class GameContainer(ShowBase):
 
     def __init__(self):
@@ -409,97 +2482,93 @@ class GameContainer(ShowBase):
 
         ########## Gameplay settings #########
 
-        self.gameMode = {"display" : PLAY, "play" : TERRAIN}
+        self.gameMode = {"display" : None, "play" : TERRAIN}
 
         self.level = 1.5
 
-        self.mode_initialized = False
+        self.profiler = FrameProfiler(DEBUG_SETTINGS["profile"])
+        self.profiler.startFrameTiming()
+
+        self.frameStages = FrameStages(TASK_CHAIN_SETTINGS["order"])
 
         ######### Camera #########
 
         self.disableMouse()
 
-        self.mainCamera = Camera(self.camera)
+        self.mainCamera = CameraRig(self.camera)
+
+        self.skybox = SkyboxService(self.camera)
+
+        self.modelCache = ModelCache()
+
+        self.leakDetector = LeakDetector(DEBUG_SETTINGS["leak_check"])
 
-        self.mainCamera.camObject.setHpr(0, 0, 0)
+        self.avatar = None
+        self.environ = None
+        self.asteroidManager = None
+        self.collisionTraverser = None
 
         self.loadLevel()
 
         ######### Events #########
 
-        self.taskMgr.add(self.gameLoop, "gameLoop", priority = 35)
-
-        self.keys = {"w" : 0, "s" : 0, "a" : 0, "d" : 0, "space" : 0,
-                     "escape" : 0}
-
-        self.accept("w", self.setKey, ["w", 1])
-        self.accept("w-up", self.setKey, ["w", 0])
-        self.accept("s", self.setKey, ["s", 1])
-        self.accept("s-up", self.setKey, ["s", 0])
-        self.accept("a", self.setKey, ["a", 1])
-        self.accept("a-up", self.setKey, ["a", 0])
-        self.accept("d", self.setKey, ["d", 1])
-        self.accept("d-up", self.setKey, ["d", 0])
-        self.accept("space", self.setKey, ["space", 1])
-        self.accept("space-up", self.setKey, ["space", 0])
-        self.accept("escape", self.setKey, ["escape", 1])
-        self.accept("escape-up", self.setKey, ["escape", 0])
+        self.input = InputState(KEY_BINDINGS_FILE)
+
+        self.mouseLook = MouseLook(self.win)
+
         self.accept("wheel_up", self.zoomCamera, [-1])
         self.accept("wheel_down", self.zoomCamera, [1])
 
-        self.accept("window-event", self.handleWindowEvent)
+        self.frameStages.add(self.processKeys, "processKeys", "input")
+
+        self.debugDraw = DebugDraw(self.frameStages) if DEBUG_SETTINGS["debug_draw"] else None
 
         ######### GUI #########
 
         #self.fonts = {"failure" : loader.loadFont('myfont.ttf')}
 
-        self.guiElements = []
-
-        self._GCLK = None
-        self._FT = None
+        self.screens = ScreenCache()
 
-        #Trigger game chain
+        self.particles = ParticleBudgetManager(self.frameStages, self.profiler)
 
-        #self.enableParticles()
+        ######### Simulation #########
 
-        #self.buildMainMenu()
+        self.simulationTasks = TaskGroup("simulation", self.frameStages)
 
-    def setKey(self, key, value):
+        ######### Display modes #########
 
-        self.keys[key] = value
+        self.displayModes = DisplayModeStack()
 
-    def zoomCamera(self, direction):
+        self.displayModeTypes = {MAIN_MENU : MainMenuMode, PLAY : PlayMode,
+                                 IN_GAME_MENU : InGameMenuMode, DEAD : DeathMode}
 
-        if self.gameMode["play"] == TERRAIN:
+        #Trigger game chain
 
-            Camera.AVATAR_DIST += direction
+        self.switchDisplayMode(PLAY)
 
-    def toggleCursor(self, state):
+        if DEBUG_SETTINGS["leak_cycle"]: self.leakDetector.startCycle(self)
 
-        props = WindowProperties()
-        props.setCursorHidden(state) 
-        base.win.requestProperties(props)
+    def zoomCamera(self, direction):
 
-    def handleWindowEvent(self, window=None):
+        if self.gameMode["play"] == TERRAIN:
 
-        wp = window.getProperties()
+            self.mainCamera.zoom(direction)
 
-        self.win_center_x = wp.getXSize() / 2
-        self.win_center_y = wp.getYSize() / 2
+    def processKeys(self, task):
 
-    def processKeys(self):
+        for bit, pressed in self.input.popEdges():
 
-        if self.keys["escape"]:
+            if bit == KEY_DEBUG_DRAW:
 
-            if self.gameMode["display"] == PLAY:
+                if pressed and self.debugDraw is not None: self.debugDraw.toggle()
 
-                self.switchDisplayMode(IN_GAME_MENU)
+                continue
 
-            elif self.gameMode["display"] == IN_GAME_MENU:
+            mode = self.displayModes.top()
 
-                self.switchDisplayMode(PLAY)
+            if mode is not None: mode.handleInput(bit, pressed)
 
-            self.setKey("escape", 0)
+        return Task.cont
 
     ######### Level specific features #########
 
@@ -509,33 +2578,23 @@ class GameContainer(ShowBase):
 
     def switchDisplayMode(self, newGameMode):
 
-        self.cleanupGUI()
-
-        if self.gameMode["display"] == MAIN_MENU:
-
-            pass
-
-        elif self.gameMode["display"] == IN_GAME_MENU: 
+        currentGameMode = self.gameMode["display"]
 
-            if newGameMode == PLAY:
+        if currentGameMode == PLAY and newGameMode == IN_GAME_MENU:
 
-                render.clearFog()
+            #Gameplay stays underneath the menu, paused
 
-                self.togglePhysicsPause()
+            self.displayModes.push(InGameMenuMode(self))
 
-            elif newGameMode == MAIN_MENU:
+        elif currentGameMode == IN_GAME_MENU and newGameMode == PLAY:
 
-                pass
+            self.displayModes.pop()
 
-        elif self.gameMode["display"] == PLAY:
-
-            if newGameMode == IN_GAME_MENU:
-
-                self.togglePhysicsPause()
+        else:
 
-        self.gameMode["display"] = newGameMode
+            self.displayModes.switch(self.displayModeTypes[newGameMode](self))
 
-        self.mode_initialized = False
+        self.gameMode["display"] = self.displayModes.top().MODE
 
     def advanceLevel(self):
 
@@ -561,12 +2620,10 @@ class GameContainer(ShowBase):
 
     def buildInGameMenu(self):
 
-        self.toggleCursor(False)
-
         resume_button = DirectButton(text = "Resume", scale = .1, command = (lambda: self.switchDisplayMode(PLAY)), rolloverSound=None)
         main_menu_button = DirectButton(text = "Main Menu", scale = .1, command = None, rolloverSound=None)
         options_button = DirectButton(text = "Settings", scale = .1, command = None, rolloverSound=None)
-        exit_button = DirectButton(text = "Exit", scale = .1, command = exit, rolloverSound=None)
+        exit_button = DirectButton(text = "Exit", scale = .1, command = self.quitGame, rolloverSound=None)
 
         BUTTON_SPACING = .2
         BUTTON_HEIGHT = resume_button.getSy()
@@ -578,19 +2635,14 @@ class GameContainer(ShowBase):
         options_button.setPos(Vec3(0, 0, button_positions[2]))
         exit_button.setPos(Vec3(0, 0, button_positions[3]))
 
-        self.guiElements.append(resume_button)
-        self.guiElements.append(main_menu_button)
-        self.guiElements.append(options_button)
-        self.guiElements.append(exit_button)
+        return [resume_button, main_menu_button, options_button, exit_button]
 
     def buildMainMenu(self):
 
-        self.toggleCursor(False)
-
         start_game_button = DirectButton(text = "Start", scale = .1, command = None)
         select_level_button = DirectButton(text = "Select Level", scale = .1, command = None)
         game_options_button = DirectButton(text = "Settings", scale = .1, command = None)
-        exit_button = DirectButton(text = "Exit", scale = .1, command = exit)
+        exit_button = DirectButton(text = "Exit", scale = .1, command = self.quitGame)
 
         BUTTON_SPACING = .2
         BUTTON_HEIGHT = start_game_button.getSy()
@@ -602,10 +2654,9 @@ class GameContainer(ShowBase):
         game_options_button.setPos(Vec3(0, 0, button_positions[2]))
         exit_button.setPos(Vec3(0, 0, button_positions[3]))
 
-        self.guiElements.append(start_game_button)
-        self.guiElements.append(select_level_button)
-        self.guiElements.append(game_options_button)
-        self.guiElements.append(exit_button)
+        return [start_game_button, select_level_button, game_options_button, exit_button]
+
+    def buildMenuParticles(self):
 
         particles = Particles()
         particles.setPoolSize(1000)
@@ -617,16 +2668,10 @@ class GameContainer(ShowBase):
         particles.setEmitter("SphereVolumeEmitter")
         particles.enable()
 
-        self.effect=ParticleEffect("peffect", particles)
-        self.effect.reparentTo(render)
-        #self.effect.setPos(self.avatar.objectNP.getX(), self.avatar.objectNP.getY(), self.avatar.objectNP.getZ() + 5)
-        self.effect.setPos(-1, 0, 0)
-        self.effect.enable()
+        return ParticleEffect("peffect", particles)
 
     def buildDeathScreen(self):
 
-        self.toggleCursor(False)
-
         backFrame = DirectFrame(frameColor=(1, 0, 0, .7), frameSize=(-.5, .5, -.3, .3),
                       pos=(0, 0, 0))
 
@@ -638,15 +2683,15 @@ class GameContainer(ShowBase):
         deadMessage.reparentTo(backFrame)
         restartButton.reparentTo(backFrame)
 
-        self.guiElements.append(backFrame)
-        self.guiElements.append(deadMessage)
-        self.guiElements.append(restartButton)
+        return [backFrame, deadMessage, restartButton]
+
+    def quitGame(self):
 
-    def cleanupGUI(self):
+        self.screens.destroy()
 
-        for guiElement in self.guiElements:
+        self.particles.destroy()
 
-            guiElement.destroy()
+        exit()
 
     def loadSpaceTexture(self, level):
 
@@ -657,336 +2702,234 @@ class GameContainer(ShowBase):
 
         self.switchDisplayMode(PLAY)
 
-        self.loadLevel(True)
-
-    def loadLevel(self, reset=False):
-
-        #Resets
+        self.loadLevel()
 
-        self.avatarActor = Actor("models/panda",
-                                {"walk": "models/panda-walk"})
-        self.avatarActor.setScale(.5, .5, .5)
-        self.avatarActor.setHpr(180, 0, 0)
-        self.avatarActor.setCollideMask(BitMask32.allOff())
+    def unloadLevel(self):
 
-        self.asteroidManager = AsteroidManager()
+        #Tear down everything loadLevel builds, leaving only the shared services behind
 
-        self.cTrav = CollisionTraverser()
+        self.mainCamera.detach()
 
-        #Alternate modes
+        if self.collisionTraverser is not None: self.collisionTraverser.clearColliders()
 
-        if int(self.level) == self.level: self.gameMode["play"] = TERRAIN
+        if self.asteroidManager is not None:
 
-        else: self.gameMode["play"] = SPACE
+            self.asteroidManager.destroy()
 
-        #Specifics
+            self.asteroidManager = None
 
-        if self.gameMode["play"] == SPACE:
+        if self.environ is not None:
 
-            if reset:
+            self.environ.removeNode()
 
-                self.avatar.reset()
+            self.environ = None
 
-            else:
+        if self.avatar is not None:
 
-                self.avatar = Avatar(self.avatarActor, self.level)
+            self.avatarActor.cleanup()
 
-                self.avatar.objectNP.reparentTo(render)
+            self.avatar.destroy()
 
-            ########## Sky #########
+            self.avatar = None
 
-            cubeMap = loader.loadCubeMap(self.loadSpaceTexture(self.level))
-            self.spaceSkyBox = loader.loadModel('models/box')
-            self.spaceSkyBox.setScale(100)
-            self.spaceSkyBox.setBin('background', 0)
-            self.spaceSkyBox.setDepthWrite(0)
-            self.spaceSkyBox.setTwoSided(True)
-            self.spaceSkyBox.setTexGen(TextureStage.getDefault(), TexGenAttrib.MWorldCubeMap)
-            self.spaceSkyBox.setTexture(cubeMap, 1)
-            parentNP = render.attachNewNode('parent')
-            self.spaceSkyBox.reparentTo(parentNP)
-            self.spaceSkyBox.setPos(-self.spaceSkyBox.getSx()/2, -self.spaceSkyBox.getSy()/2, 
-                                    -self.spaceSkyBox.getSz()/2)
+    def loadLevel(self):
 
-            ########## Collisions #########
+        hadLevel = self.avatar is not None
 
-            bound = self.avatarActor.getBounds()
+        self.unloadLevel()
 
-            self.pandaBodySphere = CollisionSphere(bound.getCenter()[0]/self.avatar.objectNP.getSx() - self.avatar.objectNP.getX(),
-                                                   bound.getCenter()[1]/self.avatar.objectNP.getSx() - self.avatar.objectNP.getY(),
-                                                   bound.getCenter()[2]/self.avatar.objectNP.getSx() - self.avatar.objectNP.getZ(), 5)
+        #Only a level that actually ran could have left anything behind
 
-            self.pandaBodySphere.setRadius(bound.getRadius() + 1)
+        if hadLevel: self.leakDetector.check("before level %s" % self.level, self.collisionTraverser)
 
-            self.pandaBodySphereNode = CollisionNode("playerBodyRay")
-            self.pandaBodySphereNode.addSolid(self.pandaBodySphere)
-            self.pandaBodySphereNode.setFromCollideMask(BitMask32.bit(0))
-            self.pandaBodySphereNode.setIntoCollideMask(BitMask32.allOff())
+        self.avatarActor = Actor("models/panda",
+                                {"walk": "models/panda-walk"})
+        self.avatarActor.setScale(.5, .5, .5)
+        self.avatarActor.setHpr(180, 0, 0)
+        self.avatarActor.setCollideMask(BitMask32.allOff())
 
-            self.pandaBodySphereNodepath = self.avatar.objectNP.attachNewNode(self.pandaBodySphereNode)
-            self.pandaBodySphereNodepath.show()
+        self.asteroidManager = AsteroidManager(self.modelCache)
 
-            self.collisionNotifier = CollisionHandlerEvent()
-            self.collisionNotifier.addInPattern("%fn-in")
-            self.collisionNotifier.addOutPattern("%fn-out")
+        #Not base.cTrav, which ShowBase would traverse a second time every frame
 
-            self.cTrav.addCollider(self.pandaBodySphereNodepath, self.collisionNotifier)
+        self.collisionTraverser = CollisionTraverser()
+        self.collisionTraverser.setRespectPrevTransform(COLLISION_SETTINGS["continuous"])
 
-            self.accept("playerGroundRayJumping-in", self.avatar.handleCollisionEvent, ["in"])
-            self.accept("playerGroundRayJumping-out", self.avatar.handleCollisionEvent, ["out"])
-            self.accept("playerBodyRay-in", self.avatar.handleCollisionEvent, ["in"])
+        self.collisionDispatcher = CollisionDispatcher(self.collisionTraverser)
 
-            self.asteroidManager.initialize(self.level)
+        #Alternate modes
 
-        elif self.gameMode["play"] == TERRAIN:
+        if int(self.level) == self.level: self.gameMode["play"] = TERRAIN
 
-            ########## Terrain #########
+        else: self.gameMode["play"] = SPACE
 
-            #self.environ = loader.loadModel("../mystuff/test.egg")
-            self.environ = loader.loadModel("models/environment")
-            self.environ.setName("terrain")
-            self.environ.reparentTo(render)
-            self.environ.setPos(0, 0, 0)
-            self.environ.setCollideMask(BitMask32.bit(0))
+        #Specifics
 
-            ######### Physics #########
+        if self.gameMode["play"] == SPACE:
 
-            self.enableParticles()
+            self.avatarRootNP = render.attachNewNode("player")
+            self.avatarActor.reparentTo(self.avatarRootNP)
 
-            gravityForce = LinearVectorForce(0, 0, -9.81)
-            gravityForce.setMassDependent(False)
-            gravityFN = ForceNode("world-forces")
-            gravityFN.addForce(gravityForce)
-            render.attachNewNode(gravityFN)
-            base.physicsMgr.addLinearForce(gravityForce)
+            self.avatar = Avatar(self.avatarRootNP, SPACE)
 
-            self.avatarPhysicsActorNP = render.attachNewNode(ActorNode("player"))
-            self.avatarPhysicsActorNP.node().getPhysicsObject().setMass(50.)
-            self.avatarActor.reparentTo(self.avatarPhysicsActorNP)
-            base.physicsMgr.attachPhysicalNode(self.avatarPhysicsActorNP.node())
+            ########## Sky #########
 
-            self.avatarPhysicsActorNP.setPos(15, 10, 5)
+            self.skybox.show(self.loadSpaceTexture(self.level))
 
-            ######### Game objects #########
+            ########## Collisions #########
 
-            self.avatar = Avatar(self.avatarPhysicsActorNP, self.level)
+            #The actor's bounds already include its own transform, so they are in avatar space
 
-            ######### Collisions #########
+            bound = self.avatarActor.getBounds()
 
-            self.pandaBodySphere = CollisionSphere(0, 0, 4, 3)
+            self.pandaBodySphere = CollisionSphere(bound.getCenter(),
+                                                   (bound.getRadius() + 1) * self.avatarActor.getSx())
 
-            self.pandaBodySphereNode = CollisionNode("playerBodySphere")
+            self.pandaBodySphereNode = CollisionNode("playerBodyRay")
             self.pandaBodySphereNode.addSolid(self.pandaBodySphere)
-            self.pandaBodySphereNode.setFromCollideMask(BitMask32.bit(0))
+            self.pandaBodySphereNode.setFromCollideMask(BitMask32(CATEGORY_ASTEROID))
             self.pandaBodySphereNode.setIntoCollideMask(BitMask32.allOff())
 
             self.pandaBodySphereNodepath = self.avatar.objectNP.attachNewNode(self.pandaBodySphereNode)
-            self.pandaBodySphereNodepath.show()
-
-            self.pandaBodyCollisionHandler = PhysicsCollisionHandler()
-            self.pandaBodyCollisionHandler.addCollider(self.pandaBodySphereNodepath, self.avatar.objectNP)
-
-            #Keep player on ground
-
-            self.pandaGroundSphere = CollisionSphere(0, 0, 1, 1)
-
-            self.pandaGroundSphereNode = CollisionNode("playerGroundRay")
-            self.pandaGroundSphereNode.addSolid(self.pandaGroundSphere)
-            self.pandaGroundSphereNode.setFromCollideMask(BitMask32.bit(0))
-            self.pandaGroundSphereNode.setIntoCollideMask(BitMask32.allOff())
-
-            self.pandaGroundSphereNodepath = self.avatar.objectNP.attachNewNode(self.pandaGroundSphereNode)
-            self.pandaGroundSphereNodepath.show()
-
-            self.pandaGroundCollisionHandler = PhysicsCollisionHandler()
-            self.pandaGroundCollisionHandler.addCollider(self.pandaGroundSphereNodepath, self.avatar.objectNP)
-
-            #Notify when player lands
-
-            self.pandaGroundRayJumping = CollisionSphere(0, 0, 1, 1)
 
-            self.pandaGroundRayNodeJumping = CollisionNode("playerGroundRayJumping")
-            self.pandaGroundRayNodeJumping.addSolid(self.pandaGroundRayJumping)
-            self.pandaGroundRayNodeJumping.setFromCollideMask(BitMask32.bit(0))
-            self.pandaGroundRayNodeJumping.setIntoCollideMask(BitMask32.allOff())
+            self.collisionDispatcher.addCollider(self.pandaBodySphereNodepath,
+                                                 {CATEGORY_ASTEROID : self.avatar.handleAsteroidContact})
 
-            self.pandaGroundRayNodepathJumping = self.avatar.objectNP.attachNewNode(self.pandaGroundRayNodeJumping)
-            self.pandaGroundRayNodepathJumping.show()
+            self.asteroidManager.initialize(self.level, self.avatar.objectNP)
 
-            self.collisionNotifier = CollisionHandlerEvent()
-            self.collisionNotifier.addInPattern("%fn-in")
-            self.collisionNotifier.addOutPattern("%fn-out")
+            self.mainCamera.attach(self.avatar.objectNP, self.collisionDispatcher, CATEGORY_CAMERA_OCCLUDER)
 
-            self.cTrav.addCollider(self.pandaGroundSphereNodepath, self.pandaGroundCollisionHandler)
-            self.cTrav.addCollider(self.pandaGroundRayNodepathJumping, self.collisionNotifier)
-            self.cTrav.addCollider(self.pandaBodySphereNodepath, self.pandaBodyCollisionHandler)
-
-            self.accept("playerGroundRayJumping-in", self.avatar.handleCollisionEvent, ["in"])
-            self.accept("playerGroundRayJumping-out", self.avatar.handleCollisionEvent, ["out"])
-            self.accept("playerBodyRay-in", self.avatar.handleCollisionEvent, ["in"])
-
-    def togglePhysicsPause(self):
-
-        if (self._GCLK == None):
-
-            self.disableParticles()
-
-            self._GCLK = ClockObject.getGlobalClock()
-            self._FT = self._GCLK.getFrameTime()
-            self._GCLK.setMode(ClockObject.MSlave)
-
-        else:
-
-            self._GCLK.setRealTime(self._FT)
-            self._GCLK.setMode(ClockObject.MNormal)
-
-            self.enableParticles()
-
-            self._GCLK = None
-
-    def gameLoop(self, task):
-
-        dt = globalClock.getDt()
-
-        self.processKeys()
-
-        if self.gameMode["display"] == MAIN_MENU:
-
-            if not self.mode_initialized:
-
-                self.buildMainMenu()
+        elif self.gameMode["play"] == TERRAIN:
 
-                self.mode_initialized = True
+            self.skybox.hide()
 
-        if self.gameMode["display"] == IN_GAME_MENU:
+            ########## Terrain #########
 
-            if not self.mode_initialized:
+            self.environ = render.attachNewNode("terrain")
+            self.environ.setPos(0, 0, 0)
 
-                #Fog out background
+            #terrainCollision = loader.loadModel("../mystuff/test.egg")
+            terrainCollision = loader.loadModel("models/environment")
 
-                inGameMenuFogColor = (50, 150, 50)
+            #Only the rendered copy is flattened; it is never collided with
 
-                inGameMenuFog = Fog("inGameMenuFog")
+            terrainRender = terrainCollision.copyTo(self.environ)
+            terrainRender.setName("terrainRender")
 
-                inGameMenuFog.setMode(Fog.MExponential)
-                inGameMenuFog.setColor(*inGameMenuFogColor)
-                inGameMenuFog.setExpDensity(.01)
+            flattenStatic(terrainRender, "terrain")
 
-                render.setFog(inGameMenuFog)
+            terrainRender.setCollideMask(BitMask32.allOff())
 
-                self.buildInGameMenu()
+            #The collision copy keeps the model's node hierarchy, so the ground ray and camera
+            #segment are culled by node bounds before testing triangles; it is never drawn
 
-                self.mode_initialized = True
+            terrainCollision.setName("terrainCollision")
+            terrainCollision.reparentTo(self.environ)
+            terrainCollision.hide()
 
-        if self.gameMode["display"] == DEAD:
+            terrainCollision.setCollideMask(BitMask32(CATEGORY_GROUND | CATEGORY_CAMERA_OCCLUDER))
 
-            if not self.mode_initialized:
+            ######### Game objects #########
 
-                self.buildDeathScreen()
+            self.avatarRootNP = render.attachNewNode("player")
+            self.avatarActor.reparentTo(self.avatarRootNP)
 
-                self.mode_initialized = True
+            self.avatarRootNP.setPos(15, 10, 5)
 
-        if self.gameMode["display"] == PLAY:
+            self.avatar = Avatar(self.avatarRootNP, TERRAIN)
 
-            alive = self.avatar.states["alive"]
+            ######### Collisions #########
 
-            if not self.mode_initialized:
+            #Gravity, jumping and ground following are integrated by the controller
 
-                self.toggleCursor(True)
+            self.avatar.attachController(KinematicController(self.avatar.objectNP, self.collisionDispatcher, CATEGORY_GROUND))
 
-                self.last_mouse_x = self.win.getPointer(0).getX()
-                self.last_mouse_y = self.win.getPointer(0).getY()
+            self.mainCamera.attach(self.avatar.objectNP, self.collisionDispatcher, CATEGORY_CAMERA_OCCLUDER)
 
-                self.mode_initialized = True
+        self.mainCamera.start(self.frameStages)
 
-            if self.gameMode["play"] == TERRAIN:
+    def gameLoop(self, task):
 
-                if alive:
+        #Per-frame simulation; suspended with the simulation task group while paused
 
-                    self.maintainTurrets()
-                    self.avatar.move(dt)
+        dt = globalClock.getDt()
 
-                else: self.switchDisplayMode(DEAD)
+        if not self.avatar.isAlive():
 
-            elif self.gameMode["play"] == SPACE:
+            self.switchDisplayMode(DEAD)
 
-                if alive:
+            return Task.done
 
-                    self.asteroidManager.maintainAsteroidField(self.avatar.objectNP.getPos(), 
-                            self.avatar.speed, Camera.AVATAR_DIST, dt)
+        if self.gameMode["play"] == TERRAIN:
 
-                else: self.switchDisplayMode(DEAD)
+            self.profiler.start("avatar")
 
-            if alive:
+            self.maintainTurrets()
+            self.avatar.move(dt)
 
-                #Handle keyboard input
+            self.profiler.stop("avatar")
 
-                self.avatar.handleKeys(self.keys, self.gameMode["play"])
+        elif self.gameMode["play"] == SPACE:
 
-                ########## Mouse-based viewpoint rotation ##########
+            self.profiler.start("asteroids")
 
-                mouse_pos = self.win.getPointer(0)
+            self.asteroidManager.maintainAsteroidField(self.avatar.objectNP.getPos(), self.avatar.speed, dt)
 
-                current_mouse_x = mouse_pos.getX()
-                current_mouse_y = mouse_pos.getY()
+            self.profiler.stop("asteroids")
 
-                #Side to side
+            self.profiler.setCounter("asteroidsLive", len(self.asteroidManager.asteroids))
+            self.profiler.addCount("asteroidsSpawned", self.asteroidManager.spawned)
+            self.profiler.addCount("asteroidsCulled", self.asteroidManager.culled)
 
-                if self.gameMode["play"] == TERRAIN:
+            if self.profiler.enabled:
 
-                    mouse_shift_x = current_mouse_x - self.last_mouse_x
-                    self.last_mouse_x = current_mouse_x
+                self.profiler.setCounter("asteroidTriangles", self.asteroidManager.submittedTriangles(self.camera))
 
-                    if current_mouse_x < 5 or current_mouse_x >= (self.win_center_x * 1.5):
+        #Handle keyboard input
 
-                        base.win.movePointer(0, self.win_center_x, current_mouse_y)
-                        self.last_mouse_x = self.win_center_x
+        self.avatar.handleKeys(self.input.held)
 
-                    yaw_shift = -((mouse_shift_x) * Camera.ROT_RATE[0])
+        return Task.cont
 
-                    self.avatar.yawRot += yaw_shift
+    def collisionLoop(self, task):
 
-                    self.avatar.objectNP.setH(self.avatar.yawRot)
+        #Find collisions
 
-                #Up and down
+        self.profiler.start("collision")
 
-                mouse_shift_y = current_mouse_y - self.last_mouse_y
-                self.last_mouse_y = current_mouse_y
+        self.collisionTraverser.traverse(render)
 
-                if current_mouse_y < 5 or current_mouse_y >= (self.win_center_y * 1.5):
+        #Ground, camera arm and asteroid contacts are all handled from here
 
-                    base.win.movePointer(0, current_mouse_x, self.win_center_y)
-                    self.last_mouse_y = self.win_center_y
+        self.collisionDispatcher.dispatch()
 
-                pitch_shift = -((mouse_shift_y) * Camera.ROT_RATE[1])
+        self.profiler.stop("collision")
 
-                self.mainCamera.pitchRot += pitch_shift
+        self.profiler.setCounter("colliders", self.collisionTraverser.getNumColliders())
 
-                if self.mainCamera.pitchRot > Camera.FLEX_ROT_BOUND[0]:
+        return Task.cont
+ 
+    def lookLoop(self, task):
 
-                    self.mainCamera.pitchRot = Camera.FLEX_ROT_BOUND[0]
+        ########## Mouse-based viewpoint rotation ##########
 
-                elif self.mainCamera.pitchRot < -Camera.FLEX_ROT_BOUND[0]:
+        self.mouseLook.sample()
 
-                    self.mainCamera.pitchRot = -Camera.FLEX_ROT_BOUND[0]
+        #Side to side
 
-                xy_plane_cam_dist = Camera.AVATAR_DIST
+        if self.gameMode["play"] == TERRAIN:
 
-                cam_x_adjust = xy_plane_cam_dist*sin(radians(self.avatar.yawRot))  
-                cam_y_adjust = xy_plane_cam_dist*cos(radians(self.avatar.yawRot))
-                cam_z_adjust = Camera.ELEVATION
+            yaw_shift = -(self.mouseLook.deltaX * CameraRig.ROT_RATE[0])
 
-                self.mainCamera.camObject.setH(self.avatar.yawRot)
-                self.mainCamera.camObject.setP(self.mainCamera.pitchRot)
+            self.avatar.yawRot += yaw_shift
 
-                self.mainCamera.camObject.setPos(self.avatar.objectNP.getX() + cam_x_adjust, self.avatar.objectNP.getY() - cam_y_adjust, 
-                                self.avatar.objectNP.getZ() + cam_z_adjust)
+            self.avatar.objectNP.setH(self.avatar.yawRot)
 
-                #Find collisions
+        #Up and down
 
-                self.cTrav.traverse(render)
+        self.mainCamera.addPitch(-(self.mouseLook.deltaY * CameraRig.ROT_RATE[1]))
 
         return Task.cont
- 
+
 app = GameContainer()
 app.run()
\ No newline at end of file
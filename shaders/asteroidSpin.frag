@@ -0,0 +1,29 @@
+#version 150
+
+uniform sampler2D p3d_Texture0;
+uniform vec4 p3d_ColorScale;
+
+//Matches the exponential fog the in-game menu puts on render. fogEnabled is 1 only
+//while that fog is set; otherwise p3d_Fog holds placeholder values
+
+uniform float fogEnabled;
+
+uniform struct p3d_FogParameters {
+    vec4 color;
+    float density;
+} p3d_Fog;
+
+in vec2 texcoord;
+in vec4 color;
+in float eyeDistance;
+
+out vec4 fragColor;
+
+void main() {
+
+    vec4 result = texture(p3d_Texture0, texcoord) * color * p3d_ColorScale;
+
+    float fogFactor = mix(1.0, clamp(exp(-p3d_Fog.density * eyeDistance), 0.0, 1.0), fogEnabled);
+
+    fragColor = vec4(mix(p3d_Fog.color.rgb, result.rgb, fogFactor), result.a);
+}
@@ -0,0 +1,43 @@
+#version 150
+
+//Spins an asteroid about its own origin so the CPU never touches its rotation.
+//spin.xyz is the unit spin axis and spin.w the rate in radians per second;
+//fieldTime is advanced by the asteroid field each simulation step
+
+uniform mat4 p3d_ModelViewProjectionMatrix;
+uniform mat4 p3d_ModelViewMatrix;
+
+uniform vec4 spin;
+uniform float fieldTime;
+
+in vec4 p3d_Vertex;
+in vec4 p3d_Color;
+in vec2 p3d_MultiTexCoord0;
+
+out vec2 texcoord;
+out vec4 color;
+out float eyeDistance;
+
+void main() {
+
+    float angle = spin.w * fieldTime;
+
+    float c = cos(angle);
+    float s = sin(angle);
+
+    vec3 axis = spin.xyz;
+    vec3 position = p3d_Vertex.xyz;
+
+    //Rodrigues' rotation about the spin axis
+
+    vec3 rotated = position * c + cross(axis, position) * s + axis * dot(axis, position) * (1.0 - c);
+
+    vec4 vertex = vec4(rotated, p3d_Vertex.w);
+
+    gl_Position = p3d_ModelViewProjectionMatrix * vertex;
+
+    texcoord = p3d_MultiTexCoord0;
+    color = p3d_Color;
+
+    eyeDistance = length((p3d_ModelViewMatrix * vertex).xyz);
+}